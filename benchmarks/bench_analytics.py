@@ -0,0 +1,60 @@
+# The four dashboard aggregates computed by the SQL backend (SQLite stand-in, plus an optional round trip
+# per query) vs the in-process DuckDB backend over the staged Parquet files (API_QUERY_BACKEND=duckdb)
+# Usage: python -m benchmarks.bench_analytics [fact rows] [runs] [SQL round trip ms]
+import os, sys, time, tempfile
+import numpy as np
+import pandas as pd
+
+def median_ms(func, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, np.median(timings) * 1000
+
+def same(a, b):
+    a, b = pd.DataFrame(a), pd.DataFrame(b)
+    # Rows that tie in the ORDER BY may come back in either order
+    a, b = [frame.sort_values(list(frame.columns)).reset_index(drop=True) for frame in (a, b)]
+    try:
+        pd.testing.assert_frame_equal(a, b, check_dtype=False, rtol=1e-6)
+        return True
+    except AssertionError:
+        return False
+
+def main(fact_rows, runs, latency_ms):
+    from benchmarks.stub_database import install_stub, tables
+    from utils.staging import StagingArea
+    from utils.aggregates import summary_tables, live_query
+    from utils.datasetup import AzureDB
+    from utils.analytics import AnalyticsEngine
+
+    install_stub(latency=latency_ms / 1000, fact_rows=fact_rows, summaries=True)
+    staging = StagingArea(local_path=tempfile.mkdtemp(), staging_format="parquet")
+    for table in tables:
+        # The same rows the stub database holds
+        data = pd.read_csv(os.path.join("data", f"{table}.csv"), index_col=0)
+        if table == "Crypto_Fact":
+            data = data.sample(fact_rows, replace=True, random_state=0)
+            data["Crypto_Fact_ID"] = range(1, fact_rows + 1)
+        staging.write(table, data)
+
+    sql = AzureDB(role="api")
+    # Touched after the tables are staged, as the ETL does once a load completes
+    staging.mark_complete()
+    analytics = AnalyticsEngine(staging=staging)
+    _, refresh_ms = median_ms(analytics.refresh, 1)
+    print(f"{fact_rows} fact rows, {latency_ms} ms SQL round trip, median of {runs} runs; DuckDB load {refresh_ms:.0f} ms")
+    print(f"{'query':<30} {'SQL ms':>9} {'DuckDB live ms':>15} {'DuckDB summary ms':>18} {'same':>5}")
+    for name in summary_tables:
+        query = live_query(name)
+        expected, sql_ms = median_ms(lambda: sql.get_sql_columns(query, name), runs)
+        result, live_ms = median_ms(lambda: analytics.get_columns(query, name), runs)
+        # What the API reads: the summary table, materialized when the DuckDB database is loaded
+        _, summary_ms = median_ms(lambda: analytics.get_columns(f"SELECT * FROM [dbo].[{name}]", name), runs)
+        print(f"{name:<30} {sql_ms:>9.2f} {live_ms:>15.2f} {summary_ms:>18.3f} {str(same(expected, result)):>5}")
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [1000000, 20, 0][len(args):]))
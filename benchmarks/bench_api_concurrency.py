@@ -0,0 +1,76 @@
+# API latency under concurrent clients: blocking queries on the event loop vs the bounded SQL executor
+# Usage: python -m benchmarks.bench_api_concurrency [clients] [requests per client] [query latency ms]
+# The API runs in a subprocess against benchmarks.stub_database, so client and server do not share a GIL.
+import os, sys, time, json, asyncio, subprocess
+import numpy as np
+
+overview_queries = [
+    "SELECT CD.[ISO_Stdised_Key (PK)] AS Crypto, ROUND(AVG(PV.Price_Variation), 2) AS Avg_Variation, COUNT(*) AS Entry_Count FROM [dbo].[Crypto_Fact] CF JOIN [dbo].[PriceVariations_dim] PV ON CF.PriceVariations_id = PV.PriceVariations_id JOIN [dbo].[Crypto_dim] CD ON CF.Crypto_id = CD.Crypto_id GROUP BY CD.[ISO_Stdised_Key (PK)] ORDER BY Avg_Variation DESC;",
+    "SELECT PV.Price_Variation_Type, COUNT(*) AS Frequency FROM [dbo].[Crypto_Fact] CF JOIN [dbo].[PriceVariations_dim] PV ON CF.PriceVariations_id = PV.PriceVariations_id GROUP BY PV.Price_Variation_Type;",
+]
+
+def serve(port, latency_ms):
+    import uvicorn
+    from benchmarks.stub_database import install_stub
+    os.environ["QUERY_CACHE_SIZE"] = "0"  # every request goes to the database
+    install_stub(latency=latency_ms / 1000, summaries=True)
+    from utils import api
+
+    @api.app.get("/benchmark/blocking")
+    async def blocking_overview(current_user: api.User = api.Depends(api.check_user_role("manager"))):
+        # The previous implementation: both queries run one after the other on the event loop
+        return json.dumps([api.database.get_sql_table(q) for q in overview_queries])
+
+    @api.app.get("/benchmark/token")
+    async def benchmark_token():
+        return api.create_access_token({"sub": "admin"})
+
+    uvicorn.run(api.app, port=port, log_level="warning")
+
+async def run_clients(url, headers, clients, requests_per_client):
+    import httpx
+    latencies = []
+    async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=clients)) as client:
+        async def worker():
+            for _ in range(requests_per_client):
+                start = time.perf_counter()
+                response = await client.get(url, headers=headers)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+    return np.array(latencies) * 1000, len(latencies) / elapsed
+
+def start_server(port, *args, module="benchmarks.bench_api_concurrency"):
+    import httpx
+    server = subprocess.Popen([sys.executable, "-m", module, "--serve", str(port)] + [str(arg) for arg in args])
+    for _ in range(600):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("API did not start")
+
+def main(clients, requests_per_client, latency_ms):
+    import httpx
+    port = 8765
+    server = start_server(port, latency_ms)
+    try:
+        headers = {"Authorization": f"Bearer {httpx.get(f'http://127.0.0.1:{port}/benchmark/token').json()}"}
+        print(f"{clients} clients x {requests_per_client} requests, {latency_ms} ms per query")
+        print(f"{'endpoint':<22} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8}")
+        for name, path in [("blocking (before)", "/benchmark/blocking"), ("executor (after)", "/data/manager")]:
+            latencies, throughput = asyncio.run(run_clients(f"http://127.0.0.1:{port}{path}", headers, clients, requests_per_client))
+            print(f"{name:<22} {np.percentile(latencies, 50):>8.1f} {np.percentile(latencies, 99):>8.1f} {throughput:>8.1f}")
+    finally:
+        server.terminate()
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--serve"]:
+        serve(int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        args = [int(arg) for arg in sys.argv[1:]]
+        main(*(args + [50, 5, 20][len(args):]))
@@ -0,0 +1,80 @@
+# Login and authenticated request throughput: argon2 verified on the event loop and every JWT decoded
+# (before) vs verification on the auth thread pool and the verified-token cache (after)
+# Usage: python -m benchmarks.bench_auth [clients] [logins per client] [requests per client]
+# Each mode runs the API in its own subprocess against benchmarks.stub_database.
+import os, sys, time, asyncio
+import numpy as np
+from benchmarks.bench_api_concurrency import start_server
+
+def serve(port, mode):
+    import uvicorn
+    from benchmarks.stub_database import install_stub
+    if mode == "before":
+        os.environ["API_TOKEN_CACHE_SIZE"] = "0"
+    install_stub(summaries=True)
+    from utils import api
+
+    @api.app.post("/benchmark/token")
+    async def inline_login(form_data: api.OAuth2PasswordRequestForm = api.Depends()):
+        # The previous login: argon2 verification on the event loop
+        user = api.authenticate_user(form_data.username, form_data.password)
+        if not user:
+            raise api.HTTPException(status_code=401)
+        return {"access_token": api.create_access_token({"sub": user["username"]}), "token_type": "bearer"}
+
+    @api.app.get("/benchmark/me")
+    async def me(current_user: api.User = api.Depends(api.get_current_user)):
+        return {"id": current_user.id}
+
+    uvicorn.run(api.app, port=port, log_level="warning")
+
+async def run_clients(client, clients, count, request, until=None):
+    # count requests per client, or as many as fit until the future `until` is done
+    latencies = []
+    async def worker():
+        sent = 0
+        while (sent < count) if until is None else not until.done():
+            sent += 1
+            start = time.perf_counter()
+            (await request(client)).raise_for_status()
+            latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return np.array(latencies) * 1000, len(latencies) / (time.perf_counter() - start)
+
+async def measure(base, login_path, clients, logins, requests):
+    import httpx
+    form = {"username": "admin", "password": "admin123"}
+    async with httpx.AsyncClient(base_url=base, timeout=300, limits=httpx.Limits(max_connections=clients * 2)) as client:
+        token = (await client.post(login_path, data=form)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        login = lambda client: client.post(login_path, data=form)
+        authenticated = lambda client: client.get("/benchmark/me", headers=headers)
+        results = {
+            "login": await run_clients(client, clients, logins, login),
+            "authenticated": await run_clients(client, clients, requests, authenticated),
+        }
+        # Authenticated requests for as long as a burst of logins is being verified
+        burst = asyncio.ensure_future(run_clients(client, clients, logins, login))
+        results["authenticated during logins"] = await run_clients(client, clients, 0, authenticated, until=burst)
+        await burst
+    return results
+
+def main(clients, logins, requests):
+    print(f"{len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()} cores, {clients} clients, {logins} logins and {requests} authenticated requests per client")
+    print(f"{'mode':<8} {'requests':<28} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8}")
+    for port, mode, login_path in [(8771, "before", "/benchmark/token"), (8772, "after", "/token")]:
+        server = start_server(port, mode, module="benchmarks.bench_auth")
+        try:
+            results = asyncio.run(measure(f"http://127.0.0.1:{port}", login_path, clients, logins, requests))
+        finally:
+            server.terminate()
+        for name, (latencies, throughput) in results.items():
+            print(f"{mode:<8} {name:<28} {np.percentile(latencies, 50):>8.1f} {np.percentile(latencies, 99):>8.1f} {throughput:>8.1f}")
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--serve"]:
+        serve(int(sys.argv[2]), sys.argv[3])
+    else:
+        args = [int(arg) for arg in sys.argv[1:]]
+        main(*(args + [10, 3, 200][len(args):]))
@@ -0,0 +1,25 @@
+# Cold start: wall time to import the API app and the ETL entry point in a fresh interpreter
+# Usage: python -m benchmarks.bench_cold_start [runs]
+import sys, time, subprocess
+
+targets = {
+    "uvicorn utils.api:app": "import utils.api",
+    "main.py": "import main",
+}
+
+def cold_start(statement):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", statement], capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+    return elapsed
+
+def main(runs):
+    print(f"{'target':<24} {'mean s':>8} {'min s':>8}")
+    for name, statement in targets.items():
+        times = [cold_start(statement) for _ in range(runs)]
+        print(f"{name:<24} {sum(times) / runs:>8.2f} {min(times):>8.2f}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
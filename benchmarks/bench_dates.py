@@ -0,0 +1,50 @@
+# Month strings of the fact rows to date keys: per-row to_datetime + strftime + key index vs the cached lookup
+# of the distinct strings and the generated calendar
+# Usage: python -m benchmarks.bench_dates [rows]
+import sys, time
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import synthetic_source
+from utils.transformations import KeyIndex
+from utils.dates import MonthLookup, calendar, month_range
+
+def parse_rows(months):
+    # The previous transform: parse and reformat every row, then key the "Month YYYY" strings
+    month = pd.to_datetime(months.astype(str), format="%b, %Y")
+    labels = pd.DataFrame({"Month_Date": month.dt.strftime("%B %Y")})
+    positions, dim = KeyIndex(["Month_Date"]).assign(labels)
+    return np.arange(1, len(dim) + 1)[positions], dim
+
+def lookup_rows(months, lookup):
+    # DimDate: yyyymm keys of the distinct strings, the calendar of their range and every row's position in it
+    keys = lookup(months)
+    dim = calendar(month_range(keys.min(), keys.max()))
+    positions = pd.Index(dim["Date_ID"]).get_indexer(keys)
+    return dim["Date_ID"].to_numpy()[positions], dim
+
+def measure(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def main(rows):
+    months = synthetic_source(rows)["Month_Date"]
+    print(f"{rows} rows, {months.nunique()} distinct months")
+    print(f"{'source dtype':<14} {'method':<22} {'wall s':>8}")
+    for dtype in ["str", "category"]:
+        source = months.astype(dtype)
+        (old_ids, old_dim), parse_time = measure(parse_rows, source)
+        lookup = MonthLookup()
+        (new_ids, new_dim), cold_time = measure(lookup_rows, source, lookup)
+        _, warm_time = measure(lookup_rows, source, lookup)
+        print(f"{dtype:<14} {'per-row parse':<22} {parse_time:>8.2f}")
+        print(f"{dtype:<14} {'lookup, cold cache':<22} {cold_time:>8.2f}")
+        print(f"{dtype:<14} {'lookup, warm cache':<22} {warm_time:>8.2f}")
+
+        # Same month for every row: the label behind each old id is the label of the new key
+        labels = new_dim.set_index("Date_ID")["Month_Date"]
+        old_labels = old_dim["Month_Date"].to_numpy()[old_ids - 1]
+        print(f"identical months: {bool((labels.reindex(new_ids).to_numpy() == old_labels).all())}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10**7)
@@ -0,0 +1,64 @@
+# API response bodies: rows as dicts JSON-encoded twice (the previous endpoints) vs the formats of utils/encoding.py,
+# timed from an open cursor to the response body and back to a DataFrame on the client
+# Usage: python -m benchmarks.bench_encoding [rows ...]
+import sys, json, time, sqlite3
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+from utils.encoding import encode, read_arrow
+from benchmarks.synthetic import symbols
+
+def summary_cursor(rows):
+    # A result shaped like Summary_Monthly_Volume: symbol, month, average volume and a count
+    rng = np.random.default_rng(0)
+    con = sqlite3.connect(":memory:")
+    con.execute("CREATE TABLE summary (Crypto TEXT, Month_Date TEXT, Avg_Monthly_Volume REAL, Entry_Count INTEGER)")
+    months = pd.date_range("2015-01-01", periods=120, freq="MS").strftime("%B %Y")
+    con.executemany("INSERT INTO summary VALUES (?, ?, ?, ?)", zip(
+        np.array(symbols)[rng.integers(0, len(symbols), rows)].tolist(), np.asarray(months)[rng.integers(0, 120, rows)].tolist(),
+        rng.uniform(1e6, 1e10, rows).round(2).tolist(), rng.integers(1, 100, rows).tolist()))
+    return lambda: con.execute("SELECT * FROM summary")
+
+def fetch_dicts(cursor):
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def fetch_columns(cursor, batch_rows=5000):
+    columns = [column[0] for column in cursor.description]
+    arrays = [[] for _ in columns]
+    getters = [itemgetter(index) for index in range(len(columns))]
+    while batch := cursor.fetchmany(batch_rows):
+        for array, getter in zip(arrays, getters):
+            array.extend(map(getter, batch))
+    return dict(zip(columns, arrays))
+
+pipelines = {
+    # json.dumps in the endpoint, then FastAPI encodes the string again; clients parse twice
+    "double json (before)": (fetch_dicts, lambda data: json.dumps(json.dumps([data])).encode(),
+                             lambda body: pd.DataFrame(json.loads(json.loads(body))[0])),
+    "records": (fetch_columns, lambda data: encode([data], "records"), lambda body: pd.DataFrame(json.loads(body)[0])),
+    "columns": (fetch_columns, lambda data: encode([data], "columns"), lambda body: pd.DataFrame(json.loads(body)[0])),
+    "arrow": (fetch_columns, lambda data: encode([data], "arrow"), lambda body: read_arrow(body)[0].to_pandas()),
+}
+
+def timed(func, *args, runs=3):
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best * 1000
+
+def main(sizes):
+    print(f"{'rows':>9} {'encoding':<22} {'fetch ms':>9} {'encode ms':>10} {'decode ms':>10} {'KB':>9}")
+    for rows in sizes:
+        query = summary_cursor(rows)
+        for name, (fetch, serialize, deserialize) in pipelines.items():
+            data, fetch_ms = timed(lambda: fetch(query()))
+            body, encode_ms = timed(serialize, data)
+            frame, decode_ms = timed(deserialize, body)
+            assert len(frame) == rows
+            print(f"{rows:>9} {name:<22} {fetch_ms:>9.1f} {encode_ms:>10.1f} {decode_ms:>10.1f} {len(body) / 1024:>9.0f}")
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 100000, 1000000])
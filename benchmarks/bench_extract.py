@@ -0,0 +1,45 @@
+# Multi-blob extract: one blob after the other vs concurrent downloads and parallel parsing
+# Usage: python -m benchmarks.bench_extract [blobs] [rows per blob] [latency ms] [MB/s per connection]
+import os, sys, time, tempfile
+import pandas as pd
+from benchmarks.synthetic import synthetic_source
+from benchmarks.stub_blob import install_blob_stub
+from utils.datasetup import AzureDB, parse_csv
+
+def write_blobs(root, blobs, rows):
+    # One file per exchange per month, like the upstream drops
+    for index in range(blobs):
+        path = os.path.join(root, "exchanges", f"exchange{index % 4}", f"2024-{index // 4 + 1:02d}.csv")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        synthetic_source(rows, seed=index).to_csv(path, index=False)
+
+def sequential(database, pattern):
+    # The previous extract, repeated for every blob
+    return pd.concat([parse_csv(database.download_blob_bytes(name)) for name in database.list_blob_names(pattern)],
+                     ignore_index=True)
+
+def main(blobs, rows, latency_ms, bandwidth_mb):
+    root = tempfile.mkdtemp()
+    write_blobs(root, blobs, rows)
+    database = AzureDB()
+    install_blob_stub(database, root, latency_ms / 1000, bandwidth_mb * 1024 * 1024)
+    database.extract_cache.max_bytes = 0  # every run downloads
+    pattern = "exchanges/*/2024-*.csv"
+
+    print(f"{blobs} blobs x {rows} rows, {latency_ms} ms latency, {bandwidth_mb} MB/s per connection, {os.cpu_count()} cores")
+    print(f"{'extract':<28} {'s':>7} {'rows/s':>10}")
+    start = time.perf_counter()
+    expected = sequential(database, pattern)
+    elapsed = time.perf_counter() - start
+    print(f"{'sequential':<28} {elapsed:>7.2f} {len(expected) / elapsed:>10.0f}")
+    for download_workers, parse_workers in [(4, 1), (8, 1), (8, 2), (8, 4), (16, os.cpu_count())]:
+        start = time.perf_counter()
+        data = database.access_blobs_csv(pattern, download_workers, parse_workers)
+        elapsed = time.perf_counter() - start
+        assert data.equals(expected)
+        name = f"{download_workers} downloads, {parse_workers} parsers"
+        print(f"{name:<28} {elapsed:>7.2f} {len(data) / elapsed:>10.0f}")
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [32, 50000, 50, 20][len(args):]))
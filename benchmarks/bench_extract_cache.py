@@ -0,0 +1,38 @@
+# Extract with and without the content-hash extract cache, for one large blob and for many small ones
+# Usage: python -m benchmarks.bench_extract_cache [rows] [blobs] [latency ms] [MB/s per connection]
+import os, sys, time, tempfile
+from benchmarks.synthetic import synthetic_source
+from benchmarks.stub_blob import install_blob_stub
+from utils.datasetup import AzureDB
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+def main(rows, blobs, latency_ms, bandwidth_mb):
+    root = tempfile.mkdtemp()
+    synthetic_source(rows).to_csv(os.path.join(root, "combined.csv"), index=False)
+    os.makedirs(os.path.join(root, "exchanges"))
+    for index in range(blobs):
+        synthetic_source(rows // blobs, seed=index).to_csv(os.path.join(root, "exchanges", f"{index:03d}.csv"), index=False)
+
+    database = AzureDB(local_path=tempfile.mkdtemp())
+    install_blob_stub(database, root, latency_ms / 1000, bandwidth_mb * 1024 * 1024)
+    print(f"{rows} rows, {latency_ms} ms latency, {bandwidth_mb} MB/s per connection")
+    print(f"{'extract':<40} {'s':>7}")
+    for name, extract in [("1 blob", lambda: database.access_blob_csv("combined.csv")),
+                          (f"{blobs} blobs", lambda: database.access_blobs_csv("exchanges/*.csv", parse_workers=1))]:
+        expected, cold = timed(extract)
+        cached, warm = timed(extract)
+        assert cached.equals(expected)
+        print(f"{name + ', cold cache':<40} {cold:>7.2f}")
+        print(f"{name + ', unchanged':<40} {warm:>7.2f}")
+    # One upstream file changes: only that blob is downloaded again
+    synthetic_source(rows // blobs, seed=blobs).to_csv(os.path.join(root, "exchanges", "000.csv"), index=False)
+    _, partial = timed(lambda: database.access_blobs_csv("exchanges/*.csv", parse_workers=1))
+    print(f"{f'{blobs} blobs, one changed':<40} {partial:>7.2f}")
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [1000000, 16, 50, 20][len(args):]))
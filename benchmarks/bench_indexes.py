@@ -0,0 +1,91 @@
+# Dashboard query times on the star schema before and after the indexes derived in utils.warehouse.fact_indexes
+# Usage: python -m benchmarks.bench_indexes [fact rows] [database file]
+# Runs against SQLite, where an index cannot INCLUDE columns, so the included columns become trailing key
+# columns, which covers the same queries. The T-SQL the loader runs is in utils.warehouse.index_statements.
+import os, sys, time, sqlite3, tempfile
+import numpy as np
+from utils.aggregates import summary_tables, live_query
+from utils.warehouse import table_definitions, fact_indexes
+
+dimension_sizes = {"Crypto_dim": 1000, "Date_dim": 120, "PriceVariations_dim": 1000000, "PriceDifferential_dim": 1000000}
+
+def create_table(con, name):
+    definition = table_definitions[name]
+    columns = ", ".join(f"[{column}] {'INTEGER' if sql_type.startswith('BIGINT') else sql_type.split()[0]}"
+                        f"{' PRIMARY KEY' if column == definition['primary_key'] else ''}"
+                        for column, sql_type in definition["columns"].items())
+    con.execute(f"CREATE TABLE [{name}] ({columns})")
+
+def random_column(rng, column, sql_type, rows, ids):
+    if column in ids:
+        return ids[column]
+    if sql_type.startswith("BIGINT"):
+        return rng.integers(1, 1000, rows)
+    if sql_type == "FLOAT":
+        return rng.normal(0, 100, rows).round(4)
+    if column == "Month_Date":
+        return np.array([f"Month {index}" for index in range(rows)])
+    if column == "ISO_Stdised_Key (PK)":
+        return np.array([f"C{index % 50}" for index in range(rows)])
+    return rng.choice(["UP", "DOWN", "UNCHANGED"], rows)
+
+def fill_table(con, name, rows, rng, ids=None, batch=1000000):
+    columns = table_definitions[name]["columns"]
+    placeholders = ", ".join("?" for _ in columns)
+    for start in range(0, rows, batch):
+        size = min(batch, rows - start)
+        batch_ids = {table_definitions[name]["primary_key"]: np.arange(start + 1, start + size + 1)}
+        batch_ids.update({column: rng.integers(1, high + 1, size) for column, high in (ids or {}).items()})
+        values = [random_column(rng, column, sql_type, size, batch_ids).tolist() for column, sql_type in columns.items()]
+        con.executemany(f"INSERT INTO [{name}] VALUES ({placeholders})", zip(*values))
+        con.commit()
+
+def build(path, rows):
+    rng = np.random.default_rng(0)
+    with sqlite3.connect(path) as con:
+        for name, size in dimension_sizes.items():
+            create_table(con, name)
+            fill_table(con, name, size, rng)
+        create_table(con, "Crypto_Fact")
+        foreign_keys = table_definitions["Crypto_Fact"]["foreign_keys"]
+        fill_table(con, "Crypto_Fact", rows, rng, {column: dimension_sizes[table] for table, column in foreign_keys.items()})
+
+def run_queries(con):
+    times, results = {}, {}
+    for name in summary_tables:
+        start = time.perf_counter()
+        results[name] = con.execute(live_query(name).replace("[dbo].", "")).fetchall()
+        times[name] = time.perf_counter() - start
+    return times, results
+
+def same_results(left, right):
+    # The index changes the scan order, so averages may differ in the last rounded digit
+    return len(left) == len(right) and all(
+        a == b or (isinstance(a, float) and abs(a - b) <= 1e-4 * max(1.0, abs(a)))
+        for row_left, row_right in zip(left, right) for a, b in zip(row_left, row_right))
+
+def main(rows, path=None):
+    path = path or os.path.join(tempfile.mkdtemp(), "bench_indexes.db")
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        build(path, rows)
+        print(f"Built {rows:,} fact rows in {time.perf_counter() - start:.0f} s")
+    con = sqlite3.connect(path)
+    for index in [row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'IX_%'")]:
+        con.execute(f"DROP INDEX [{index}]")
+
+    before, expected = run_queries(con)
+    start = time.perf_counter()
+    for key, include in fact_indexes().items():
+        con.execute(f"CREATE INDEX [IX_Crypto_Fact_{key}] ON [Crypto_Fact] ({', '.join(f'[{column}]' for column in [key] + include)})")
+    build_time = time.perf_counter() - start
+    after, results = run_queries(con)
+    assert all(same_results(sorted(results[name]), sorted(expected[name])) for name in summary_tables)
+
+    print(f"{rows:,} fact rows, indexes built in {build_time:.1f} s")
+    print(f"{'query':<30} {'before s':>9} {'after s':>9}")
+    for name in summary_tables:
+        print(f"{name:<30} {before[name]:>9.2f} {after[name]:>9.2f}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000000, sys.argv[2] if len(sys.argv) > 2 else None)
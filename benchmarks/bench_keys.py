@@ -0,0 +1,57 @@
+# Surrogate key assignment: per-dimension pd.merge vs one-pass KeyIndex lookup
+# Usage: python -m benchmarks.bench_keys [rows]
+import sys, time, tracemalloc
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import synthetic_source
+from utils.transformations import convert_volume_series, KeyIndex
+
+dimensions = {
+    "Crypto": ["ISO_Stdised_Key (PK)", "Crypto_Key (FK)", "Volume_Traded"],
+    "Date": ["Month_Date"],
+    "PriceVariations": ["High_Price", "Low_Price"],
+    "PriceDifferential": ["Open_Price", "Close_Price"],
+}
+
+def merge_keys(fact_table):
+    drop_columns = []
+    for name, columns in dimensions.items():
+        dim = fact_table[columns].drop_duplicates()
+        dim[f"{name}_id"] = range(1, len(dim) + 1)
+        fact_table = pd.merge(fact_table, dim, on=columns, how="left")
+        drop_columns += columns
+    return fact_table.drop(columns=drop_columns)
+
+def index_keys(fact_table):
+    drop_columns, keys = [], {}
+    for name, columns in dimensions.items():
+        positions, dim = KeyIndex(columns).assign(fact_table)
+        keys[f"{name}_id"] = np.arange(1, len(dim) + 1)[positions]
+        drop_columns += columns
+    fact_table = fact_table.drop(columns=drop_columns).reset_index(drop=True)
+    return pd.concat([fact_table, pd.DataFrame(keys)], axis=1)
+
+def measure(func, fact_table):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(fact_table)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def main(rows):
+    fact_table = synthetic_source(rows)
+    fact_table["Volume_Traded"] = convert_volume_series(fact_table["Volume_Traded"])
+    print(f"{rows} rows, {fact_table.memory_usage(deep=True).sum() / 2**20:.0f} MiB input")
+
+    expected, merge_time, merge_peak = measure(merge_keys, fact_table)
+    del expected
+    actual, index_time, index_peak = measure(index_keys, fact_table)
+    print(f"{'method':<10} {'wall s':>8} {'peak MiB':>9}")
+    print(f"{'merge':<10} {merge_time:>8.2f} {merge_peak / 2**20:>9.0f}")
+    print(f"{'key index':<10} {index_time:>8.2f} {index_peak / 2**20:>9.0f}")
+    print(f"identical: {actual.equals(merge_keys(fact_table))}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10**7)
@@ -0,0 +1,41 @@
+# Overhead of the API's request metrics (utils/metrics.py): cost of one observation, and requests per second
+# of a trivial endpoint with the metrics middleware recording vs disabled
+# Usage: python -m benchmarks.bench_metrics [requests]
+import sys, time, asyncio
+import numpy as np
+
+def observation_cost(metrics, count=200000):
+    start = time.perf_counter()
+    for i in range(count):
+        metrics.request_seconds.observe(0.003, "GET", "/benchmark", "200")
+    return (time.perf_counter() - start) / count * 1e9
+
+async def run_requests(app, requests):
+    import httpx
+    latencies = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        for _ in range(requests):
+            start = time.perf_counter()
+            (await client.get("/")).raise_for_status()
+            latencies.append(time.perf_counter() - start)
+    return np.array(latencies) * 1e6
+
+def main(requests):
+    from benchmarks.stub_database import install_stub
+    install_stub(summaries=True)
+    from utils import api
+    from utils.metrics import metrics
+
+    print(f"One histogram observation: {observation_cost(metrics):.0f} ns")
+    print(f"{requests} requests to / in process")
+    print(f"{'metrics':<10} {'p50 us':>8} {'p99 us':>8}")
+    asyncio.run(run_requests(api.app, 200))  # warm up
+    for name, enabled in [("off", False), ("on", True), ("off", False), ("on", True)]:
+        metrics.enabled = enabled
+        latencies = asyncio.run(run_requests(api.app, requests))
+        print(f"{name:<10} {np.percentile(latencies, 50):>8.1f} {np.percentile(latencies, 99):>8.1f}")
+    metrics.enabled = True
+    print(metrics.render().count("\n"), "lines served at /metrics")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
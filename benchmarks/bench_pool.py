@@ -0,0 +1,63 @@
+# API latency with a new connection per query, a cold pool and a pool warmed at startup
+# Usage: python -m benchmarks.bench_pool [clients] [requests per client] [connect latency ms] [query latency ms]
+# The API runs in a subprocess against benchmarks.stub_database; every new stub connection sleeps for the
+# connect latency to stand in for the TLS/ODBC handshake with Azure SQL.
+import os, sys, time, asyncio
+import numpy as np
+from benchmarks.bench_api_concurrency import run_clients, start_server
+
+modes = ["no pool", "cold pool", "warm pool"]
+
+def serve(port, mode, connect_latency_ms, latency_ms):
+    import uvicorn
+    from sqlalchemy.pool import NullPool
+    from benchmarks.stub_database import install_stub
+    from utils.pool import pool_settings
+    os.environ["QUERY_CACHE_SIZE"] = "0"  # every request goes to the database
+    os.environ["API_SQL_POOL_WARM"] = "1" if mode == "warm pool" else "0"
+    settings = pool_settings("api")
+    pool_kwargs = {"poolclass": NullPool} if mode == "no pool" else {
+        "poolclass": settings["poolclass"], "pool_size": settings["pool_size"], "max_overflow": settings["max_overflow"]}
+    install_stub(latency=latency_ms / 1000, connect_latency=connect_latency_ms / 1000, summaries=True, **pool_kwargs)
+    from utils import api
+
+    @api.app.get("/benchmark/token")
+    async def benchmark_token():
+        return api.create_access_token({"sub": "admin"})
+
+    uvicorn.run(api.app, port=port, log_level="warning")
+
+def main(clients, requests_per_client, connect_latency_ms, latency_ms):
+    import httpx
+    print(f"{clients} clients x {requests_per_client} requests, {connect_latency_ms} ms per new connection, {latency_ms} ms per query")
+    print(f"{'mode':<10} {'first p50':>10} {'first p99':>10} {'p50 ms':>8} {'p99 ms':>8} {'connects':>9} {'avg wait ms':>12}")
+    for index, mode in enumerate(modes):
+        port = 8770 + index
+        server = start_server(port, mode.replace(" ", "_"), connect_latency_ms, latency_ms, module="benchmarks.bench_pool")
+        try:
+            base = f"http://127.0.0.1:{port}"
+            headers = {"Authorization": f"Bearer {httpx.get(f'{base}/benchmark/token').json()}"}
+            if mode == "warm pool":
+                # Wait for the background warm-up to open the pool
+                for _ in range(600):
+                    stats = httpx.get(f"{base}/pool/stats", headers=headers).json()
+                    if stats["connects"] >= stats["pool_size"]:
+                        break
+                    time.sleep(0.1)
+            # The first burst of requests after startup, then steady traffic
+            first, _ = asyncio.run(run_clients(f"{base}/data/manager", headers, clients, 1))
+            steady, _ = asyncio.run(run_clients(f"{base}/data/manager", headers, clients, requests_per_client))
+            stats = httpx.get(f"{base}/pool/stats", headers=headers).json()
+            print(f"{mode:<10} {np.percentile(first, 50):>10.1f} {np.percentile(first, 99):>10.1f} "
+                  f"{np.percentile(steady, 50):>8.1f} {np.percentile(steady, 99):>8.1f} "
+                  f"{stats.get('connects', '-'):>9} {stats.get('avg_wait_ms', '-'):>12}")
+        finally:
+            server.terminate()
+            server.wait()
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--serve"]:
+        serve(int(sys.argv[2]), sys.argv[3].replace("_", " "), int(sys.argv[4]), int(sys.argv[5]))
+    else:
+        args = [int(arg) for arg in sys.argv[1:]]
+        main(*(args + [8, 10, 60, 5][len(args):]))
@@ -0,0 +1,55 @@
+# Peak API memory for the whole fact table: one fetchall() into row dicts (get_sql_table) vs keyset pages
+# streamed from the cursor in batches (/query/prices), against the stub database
+# Usage: python -m benchmarks.bench_query_pages [fact rows] [page rows]
+import sys, json, time, tracemalloc
+from sqlalchemy.dialects import sqlite
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak / 1024 / 1024
+
+def main(fact_rows, page_rows):
+    from benchmarks.stub_database import install_stub
+    engine = install_stub(fact_rows=fact_rows)
+    # The warehouse's primary keys, which the keyset pages seek on
+    from sqlalchemy import text
+    with engine.begin() as con:
+        for table, key in [("Crypto_Fact", "Crypto_Fact_ID"), ("Crypto_dim", "Crypto_id"), ("Date_dim", "Date_ID")]:
+            con.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS dbo.PK_{table} ON {table} ({key})"))
+    from utils.api import database
+    from utils.queries import price_page_query
+    from utils.encoding import stream_page, json_bytes
+
+    def fetch_all():
+        # The fixed endpoints' path: every row as a dict, then one JSON document
+        query = str(price_page_query(limit=fact_rows).compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+        return len(json_bytes(database.get_sql_table(query)))
+
+    def fetch_pages():
+        size, after, pages = 0, None, 0
+        while True:
+            last = None
+            for chunk in stream_page(database.stream_sql_columns(price_page_query(after=after, limit=page_rows)),
+                                     "records", "Crypto_Fact_ID", page_rows):
+                size += len(chunk)
+                last = chunk
+            pages += 1
+            after = json.loads(last[last.rindex(b'"next":') + 7:-1])
+            if after is None:
+                return size, pages
+
+    print(f"{fact_rows} fact rows")
+    print(f"{'read':<28} {'seconds':>8} {'peak MB':>8} {'MB sent':>8}")
+    size, elapsed, peak = measure(fetch_all)
+    print(f"{'fetchall + dicts (before)':<28} {elapsed:>8.2f} {peak:>8.1f} {size / 1024 / 1024:>8.1f}")
+    (size, pages), elapsed, peak = measure(fetch_pages)
+    print(f"{f'{pages} pages of {page_rows}':<28} {elapsed:>8.2f} {peak:>8.1f} {size / 1024 / 1024:>8.1f}")
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [500000, 10000][len(args):]))
@@ -0,0 +1,42 @@
+# Memory per row of the source, fact and dimension tables with the default pandas dtypes vs the compact schema
+# Usage: python -m benchmarks.bench_schema [rows]
+# Each mode runs in its own interpreter, since ETL_COMPACT_DTYPES is read when utils.schema is imported.
+import os, sys, json, time, subprocess
+
+def measure(rows):
+    from benchmarks.synthetic import synthetic_source
+    from utils.schema import apply_schema, source_schema, memory_per_row
+    from main import MainETL
+
+    source = synthetic_source(rows)
+    start = time.perf_counter()
+    source = apply_schema(source, source_schema)
+    etl = MainETL()
+    fact_table = etl.transform_chunk(source)
+    elapsed = time.perf_counter() - start
+    result = {"transform s": elapsed, "source": memory_per_row(source), "Crypto_Fact": memory_per_row(fact_table)}
+    for dim in etl.dimension_tables:
+        result[f"{dim.name}_dim"] = memory_per_row(dim.dimension_table)
+    print(json.dumps(result))
+
+def main(rows):
+    results = {}
+    for mode, compact in [("default dtypes", "false"), ("compact schema", "true")]:
+        for name in ["USERNAME_AZURE", "PASSWORD", "SERVER", "DATABASE", "ACCOUNT_STORAGE"]:
+            os.environ.setdefault(name, "benchmark")
+        output = subprocess.run([sys.executable, "-m", "benchmarks.bench_schema", "--measure", str(rows)], check=True,
+                                capture_output=True, text=True, env={**os.environ, "ETL_COMPACT_DTYPES": compact}).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{rows} rows, transform {results['default dtypes'].pop('transform s'):.2f} s with default dtypes, "
+          f"{results['compact schema'].pop('transform s'):.2f} s with the compact schema")
+    print(f"{'bytes per row':<22} {'default':>9} {'compact':>9}")
+    for table in results["default dtypes"]:
+        before, after = results["default dtypes"][table], results["compact schema"][table]
+        print(f"{table:<22} {before:>9.2f} {after:>9.2f}")
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        measure(int(sys.argv[2]))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,38 @@
+# CSV vs Parquet staging of the fact table: write time, read time and size on disk
+# Usage: python -m benchmarks.bench_staging [rows]
+import os, sys, time, tempfile
+import pandas as pd
+from benchmarks.synthetic import synthetic_fact
+from utils.staging import StagingArea
+
+def disk_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+def main(rows):
+    fact_table = synthetic_fact(rows)
+    months = pd.date_range("2015-01-01", periods=120, freq="MS").strftime("%B %Y")
+    partitions = pd.Series(months[fact_table["Date_ID"] - 1], name="Month_Date")
+    selected_months = list(months[-12:])
+    columns = ["Crypto_id", "Price_Variation"]
+
+    print(f"{rows} fact rows, reading {columns} for {len(selected_months)} of {len(months)} months")
+    print(f"{'format':<8} {'write s':>8} {'read all s':>11} {'read selected s':>16} {'size MiB':>9}")
+    for staging_format in ["csv", "parquet"]:
+        staging = StagingArea(tempfile.mkdtemp(), staging_format)
+        # The CSV copy finds the months of the fact rows through the staged date dimension
+        staging.write("Date_dim", pd.DataFrame({"Month_Date": months, "Date_ID": range(1, len(months) + 1)}))
+        _, write_time = timed(lambda: staging.write("Crypto_Fact", fact_table, partitions=partitions))
+        _, read_time = timed(lambda: staging.read("Crypto_Fact"))
+        _, selected_time = timed(lambda: staging.read("Crypto_Fact", columns=columns, partitions=selected_months))
+        size = disk_size(staging.path("Crypto_Fact")) / 2**20
+        print(f"{staging_format:<8} {write_time:>8.2f} {read_time:>11.2f} {selected_time:>16.2f} {size:>9.1f}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10**6)
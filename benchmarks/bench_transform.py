@@ -0,0 +1,28 @@
+# Row-wise vs vectorized volume parsing and UP/DOWN classification
+# Usage: python -m benchmarks.bench_transform [rows ...]
+import sys, time
+from benchmarks.synthetic import synthetic_source
+from utils.transformations import convert_volume, change_type, convert_volume_series, change_type_series
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+def main(sizes):
+    print(f"{'rows':>10} {'step':<12} {'row-wise s':>11} {'vectorized s':>13} {'speedup':>8} identical")
+    for rows in sizes:
+        source = synthetic_source(rows)
+        change = source["Open_Price"] - source["Close_Price"]
+        steps = {
+            "volume": (lambda: source["Volume_Traded"].apply(convert_volume), lambda: convert_volume_series(source["Volume_Traded"])),
+            "change type": (lambda: change.apply(change_type), lambda: change_type_series(change)),
+        }
+        for step, (rowwise, vectorized) in steps.items():
+            expected, rowwise_time = timed(rowwise)
+            actual, vectorized_time = timed(vectorized)
+            identical = expected.to_csv() == actual.to_csv()
+            print(f"{rows:>10} {step:<12} {rowwise_time:>11.3f} {vectorized_time:>13.3f} {rowwise_time / vectorized_time:>7.1f}x {identical}")
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10**5, 10**6, 10**7])
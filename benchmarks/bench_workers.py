@@ -0,0 +1,64 @@
+# API throughput with 1 to N uvicorn worker processes sharing the query cache (QUERY_CACHE_SHARED)
+# Usage: python -m benchmarks.bench_workers [max workers] [clients] [requests per client] [query latency ms]
+# Scaling needs as many free cores as workers, plus some for the clients.
+import os, sys, time, asyncio, subprocess
+import numpy as np
+from benchmarks.bench_api_concurrency import run_clients
+
+def __getattr__(name):
+    # uvicorn imports "benchmarks.bench_workers:app" in every worker; each gets its own stub database
+    if name == "app":
+        from benchmarks.stub_database import install_stub
+        install_stub(latency=float(os.environ["BENCHMARK_QUERY_LATENCY_MS"]) / 1000, summaries=True)
+        from utils.api import app
+        return app
+    raise AttributeError(name)
+
+def start_workers(port, workers, latency_ms, cache_dir):
+    import httpx
+    env = dict(os.environ, BENCHMARK_QUERY_LATENCY_MS=str(latency_ms), QUERY_CACHE_SHARED="true")
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "benchmarks.bench_workers:app", "--port", str(port),
+                               "--workers", str(workers), "--log-level", "warning"], env=env, cwd=cache_dir)
+    for _ in range(600):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("API did not start")
+
+def main(max_workers, clients, requests_per_client, latency_ms):
+    import tempfile, shutil
+    from benchmarks.stub_database import install_stub
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+    install_stub(summaries=True)
+    from utils.api import create_access_token
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+    print(f"{os.cpu_count()} cores, {clients} clients x {requests_per_client} requests to /data/manager, {latency_ms} ms per query")
+    print(f"{'workers':>7} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8} {'speedup':>8}")
+    workers, base = 1, None
+    while workers <= max_workers:
+        port = 8780 + workers
+        # Every run starts with an empty shared cache; the worker processes read the stub data from ./data
+        cache_dir = tempfile.mkdtemp()
+        os.symlink(os.path.abspath("benchmarks"), os.path.join(cache_dir, "benchmarks"))
+        os.symlink(os.path.abspath("utils"), os.path.join(cache_dir, "utils"))
+        os.makedirs(os.path.join(cache_dir, "data"))
+        for name in os.listdir("data"):
+            if name.endswith(".csv"):
+                os.symlink(os.path.abspath(os.path.join("data", name)), os.path.join(cache_dir, "data", name))
+        server = start_workers(port, workers, latency_ms, cache_dir)
+        try:
+            latencies, throughput = asyncio.run(run_clients(f"http://127.0.0.1:{port}/data/manager", headers, clients, requests_per_client))
+        finally:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(cache_dir)
+        base = base or throughput
+        print(f"{workers:>7} {np.percentile(latencies, 50):>8.1f} {np.percentile(latencies, 99):>8.1f} {throughput:>8.1f} {throughput / base:>7.2f}x")
+        workers *= 2
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [os.cpu_count() or 1, 32, 50, 5][len(args):]))
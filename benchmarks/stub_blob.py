@@ -0,0 +1,63 @@
+# Local stand-in for the Azure blob container: blobs are the files under a directory
+import os, time, hashlib
+from types import SimpleNamespace
+from datetime import datetime, timezone
+
+class FileBlob():
+    # The properties the blob service reports for a blob; the ETag changes whenever the file does
+    def __init__(self, root, name):
+        self.name = name
+        path = os.path.join(root, name)
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.etag = f'"0x{stat.st_mtime_ns:X}{stat.st_size:X}"'
+        self.last_modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+        with open(path, "rb") as blob_file:
+            self.content_settings = SimpleNamespace(content_md5=bytearray(hashlib.md5(blob_file.read()).digest()))
+
+    def get_blob_properties(self):
+        return self
+
+class FileDownloader():
+    def __init__(self, data):
+        self.data = data
+
+    def readall(self):
+        return self.data
+
+    def chunks(self, chunk_size=4 * 1024 * 1024):
+        for start in range(0, len(self.data), chunk_size):
+            yield self.data[start:start + chunk_size]
+
+class FileContainer():
+    # Every download waits latency seconds plus its size over bandwidth bytes per second per connection;
+    # with max_concurrency the blob is fetched as that many ranges in parallel, like the Azure SDK does
+    def __init__(self, root, latency=0.0, bandwidth=None):
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+    def list_blobs(self, name_starts_with=None, **kwargs):
+        names = []
+        for directory, _, files in os.walk(self.root):
+            for file_name in files:
+                name = os.path.relpath(os.path.join(directory, file_name), self.root).replace(os.sep, "/")
+                if name.startswith(name_starts_with or ""):
+                    names.append(name)
+        return [FileBlob(self.root, name) for name in sorted(names)]
+
+    def get_blob_client(self, blob_name):
+        return FileBlob(self.root, blob_name)
+
+    def download_blob(self, blob_name, max_concurrency=1, **kwargs):
+        with open(os.path.join(self.root, blob_name), "rb") as blob_file:
+            data = blob_file.read()
+        transfer = len(data) / self.bandwidth / max(max_concurrency, 1) if self.bandwidth else 0.0
+        time.sleep(self.latency + transfer)
+        return FileDownloader(data)
+
+def install_blob_stub(database, root, latency=0.0, bandwidth=None, container_name="csvfiles"):
+    # Serve an AzureDB's container from root instead of Azure
+    database.container_name = container_name
+    database._container_client = FileContainer(root, latency, bandwidth)
+    return database._container_client
@@ -0,0 +1,52 @@
+# Local stand-in for the Azure SQL warehouse, used by the API benchmarks
+import os, time, sqlite3, tempfile
+import pandas as pd
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+tables = ["Crypto_Fact", "Crypto_dim", "Date_dim", "PriceVariations_dim", "PriceDifferential_dim"]
+
+def stub_engine(latency=0.0, data_dir="./data", fact_rows=None, connect_latency=0.0, summaries=False, **pool_kwargs):
+    # SQLite copy of the star schema written by MainETL.load, attached as "dbo" so the API's T-SQL table
+    # names resolve. Every statement sleeps for latency seconds to stand in for the Azure round trip, and
+    # every new connection for connect_latency seconds to stand in for the TLS/ODBC handshake. summaries=True
+    # also materializes the summary tables, as a successful ETL load does; the API benchmarks pass it, since
+    # without them every dashboard request starts with a failing summary query.
+    path = os.path.join(tempfile.mkdtemp(), "warehouse.db")
+    with sqlite3.connect(path) as con:
+        for table in tables:
+            data = pd.read_csv(os.path.join(data_dir, f"{table}.csv"), index_col=0)
+            if table == "Crypto_Fact" and fact_rows:
+                data = data.sample(fact_rows, replace=True, random_state=0)
+                data["Crypto_Fact_ID"] = range(1, fact_rows + 1)
+            data.to_sql(table, con, index=False)
+        if summaries:
+            from utils.aggregates import summary_tables, live_query
+            for name in summary_tables:
+                con.execute(f"CREATE TABLE [{name}] AS {live_query(name).replace('[dbo].', '').rstrip(';')}")
+
+    def connect():
+        if connect_latency:
+            time.sleep(connect_latency)
+        return sqlite3.connect(":memory:", check_same_thread=False)
+
+    engine = create_engine("sqlite://", creator=connect, **(pool_kwargs or {"poolclass": QueuePool, "pool_size": 10}))
+
+    @event.listens_for(engine, "connect")
+    def attach_warehouse(dbapi_connection, connection_record):
+        dbapi_connection.execute(f"ATTACH DATABASE '{path}' AS dbo")
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def add_latency(conn, cursor, statement, parameters, context, executemany):
+        if latency:
+            time.sleep(latency)
+
+    return engine
+
+def install_stub(latency=0.0, data_dir="./data", fact_rows=None, connect_latency=0.0, summaries=False, **pool_kwargs):
+    # Point utils.datasetup at the stub before the API is imported; no Azure access is needed
+    for name in ["USERNAME_AZURE", "PASSWORD", "SERVER", "DATABASE", "ACCOUNT_STORAGE", "JWT_SECRET_KEY"]:
+        os.environ.setdefault(name, "benchmark")
+    import utils.datasetup as datasetup
+    datasetup.context.engine = stub_engine(latency, data_dir, fact_rows, connect_latency, summaries, **pool_kwargs)
+    return datasetup.context.engine
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+symbols = ["ADA", "BTC", "ETH", "SOL", "XRP", "DOGE", "DOT", "LTC"]
+
+def synthetic_source(rows, seed=0):
+    # Source-shaped rows (as read from Cryptocurrency_Combined_Data_Tables.csv) for benchmarks
+    rng = np.random.default_rng(seed)
+    months = pd.date_range("2015-01-01", periods=120, freq="MS").strftime("%b, %Y")
+    symbol = rng.integers(0, len(symbols), rows)
+    open_price = rng.uniform(0.1, 100, rows).round(4)
+    close_price = (open_price * rng.uniform(0.8, 1.2, rows)).round(4)
+    high_price = np.maximum(open_price, close_price) * rng.uniform(1.0, 1.3, rows)
+    low_price = np.minimum(open_price, close_price) * rng.uniform(0.7, 1.0, rows)
+    volume = rng.uniform(1, 999, rows).round(2).astype(str)
+    suffix = rng.choice(np.array(["B", "M", ""]), rows)
+    return pd.DataFrame({
+        "ISO_Stdised_Key (PK)": np.array(symbols)[symbol],
+        "Crypto_Key (FK)": 192000 + symbol,
+        "Month_Date": np.asarray(months)[rng.integers(0, len(months), rows)],
+        "Open_Price": open_price,
+        "High_Price": high_price.round(4),
+        "Low_Price": low_price.round(4),
+        "Close_Price": close_price,
+        "Volume_Traded": np.char.add(volume, suffix),
+        "Change_pct": rng.normal(0, 0.2, rows).round(4),
+    })
+
+def synthetic_fact(rows, seed=0):
+    # Rows shaped like the transformed Crypto_Fact table
+    rng = np.random.default_rng(seed)
+    change = rng.normal(0, 1, rows)
+    return pd.DataFrame({
+        "Change_pct": rng.normal(0, 0.2, rows).round(4),
+        "Crypto_id": rng.integers(1, 1000, rows),
+        "Date_ID": rng.integers(1, 120, rows),
+        "PriceVariations_id": np.arange(1, rows + 1),
+        "Price_Variation": change,
+        "Price_Variation_Type": np.where(change > 0, "DOWN", "UP"),
+        "Crypto_Fact_ID": np.arange(1, rows + 1),
+    })
@@ -1,105 +1,344 @@
 import os, uuid
+from datetime import datetime
 from azure.identity import DefaultAzureCredential
 from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
 from dotenv import load_dotenv
 from utils.datasetup import *
 import pandas as pd
-from utils.dimension_classes import * 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.dimension_classes import *
+from utils.transformations import convert_volume_series
+from utils.dates import MonthLookup, month_keys, key_months
+from utils.bulkload import parse_bulk_tables
+from utils.cache import query_cache
+from utils.staging import staging
+from utils.aggregates import summary_tables, materialize_statements, drop_statement
+from utils.pool import pool_stats
+from utils.schema import apply_schema, source_schema, fact_schema
+from utils.warehouse import index_statements
+from utils.profiler import profiler
 
 class MainETL():
-    def __init__(self) -> None:
+    def __init__(self, chunksize=None, load_workers=4, incremental=False, source_blobs=None, download_workers=8, parse_workers=None,
+                 fact_indexes="rowstore") -> None:
         self.drop_columns = []
         self.dimension_tables = []
-    
+        self.chunksize = chunksize
+        self.load_workers = load_workers
+        self.failed_tables = []
+        self.fact_rows = 0
+        self.incremental = incremental
+        self.watermark = None
+        self.last_month = None
+        self.month_lookup = MonthLookup()
+        # Prefix or glob of the source blobs; None reads the single combined csv file
+        self.source_blobs = source_blobs
+        self.download_workers = download_workers
+        self.parse_workers = parse_workers
+        # Indexes the dashboard queries need on Crypto_Fact: "rowstore", "columnstore" or "none"
+        self.fact_indexes = fact_indexes
+
     def extract(self, csv_file="Cryptocurrency_Combined_Data_Tables.csv"):
         print(f"Step 1: Extracting data from csv file")
-        self.fact_table = df
-        print(f"We find {len(self.fact_table.index)} rows and {len(self.fact_table.columns)} columns in csv file: {csv_file}")
+        if self.incremental:
+            self.start_from_watermark()
+        with profiler.stage("extract") as stage:
+            self.extract_source(csv_file)
+            if not self.chunksize:
+                stage.rows = len(self.fact_table)
+                stage.bytes = int(self.fact_table.memory_usage(deep=True).sum())
         print(f"Step 1 finished")
-        
-    def transform(self):
-        
-        self.fact_table[["Open_Price", "High_Price", "Low_Price", 
-                         "Close_Price", "Change_pct"]] = self.fact_table[["Open_Price", "High_Price", "Low_Price",
-                                                                                           "Close_Price", "Change_pct"]].astype(float)
-        
-        def convert_volume(x):
-            x = str(x).replace(",", "")
-            if x.endswith('B'):
-                return float(x[:-1]) * 1e9
-            elif x.endswith('M'):
-                return float(x[:-1]) * 1e6
-            else:
-                return float(x)
-
-        self.fact_table["Volume_Traded"] = self.fact_table["Volume_Traded"].apply(convert_volume)
-        self.fact_table[["ISO_Stdised_Key (PK)"]] = self.fact_table[["ISO_Stdised_Key (PK)"]].astype(str)
-        self.fact_table[["Month_Date"]] = self.fact_table[["Month_Date"]].astype(str)
-        self.fact_table[["Crypto_Key (FK)"]] = self.fact_table[["Crypto_Key (FK)"]].astype(int)
-        
-        dim_crypto = DimCrypto()
-        self.drop_columns += dim_crypto.columns
-        self.dimension_tables.append(dim_crypto)
-        
-        dim_date = DimDate()
-        self.drop_columns += dim_date.columns
-        new_dim = dim_date.dimension_table[["Month_Date"]]
-        new_dim["Month_Date"] = pd.to_datetime(new_dim["Month_Date"], format = "%b, %Y")
-        new_dim["Month_Date"] = new_dim["Month_Date"].dt.strftime("%B %Y")
-        new_dim = new_dim.drop_duplicates()
-        new_dim[f"Date_ID"] = range(1, len(new_dim) + 1)
-        dim_date.dimension_table = new_dim
-        self.dimension_tables.append(dim_date)
-        self.fact_table["Month_Date"] = pd.to_datetime(self.fact_table["Month_Date"], format = "%b, %Y")
-        self.fact_table["Month_Date"] = self.fact_table["Month_Date"].dt.strftime("%B %Y")
-        
-        dim_price_var = DimPriceVariations()
-        self.drop_columns += dim_price_var.columns
-        dim_price_var.dimension_table["Price_Variation"] = (dim_price_var.dimension_table["High_Price"] - dim_price_var.dimension_table["Low_Price"])
-        dim_price_var.dimension_table["Price_Variation_Type"] = dim_price_var.dimension_table["Price_Variation"].apply(lambda x: "DOWN" if x > 0 else "UP" if x < 0 else "UNCHANGED")
-        dim_price_var.dimension_table = dim_price_var.dimension_table.drop_duplica3()
-        dim_price_var.dimension_table["Price_Variation_ID"] = range(1, len(dim_price_var.dimension_table) + 1)
-        self.dimension_tables.append(dim_price_var)
-
-        dim_price_diff = DimPriceDifferential()
-        self.drop_columns += dim_price_diff.columns
-        dim_price_diff.dimension_table["Price_Differential"] = (dim_price_diff.dimension_table["Open_Price"] - dim_price_diff.dimension_table["Close_Price"])
-        dim_price_diff.dimension_table["Price_Differential_Type"] = dim_price_diff.dimension_table["Price_Differential"].apply(lambda x: "DOWN" if x > 0 else "UP" if x < 0 else "UNCHANGED")
-        dim_price_diff.dimension_table = dim_price_diff.dimension_table.drop_duplicates()
-        dim_price_diff.dimension_table["Price_Differential_ID"] = range(1, len(dim_price_diff.dimension_table) + 1)
-        self.dimension_tables.append(dim_price_diff)
-        
+
+    def extract_source(self, csv_file):
+        if self.source_blobs and self.chunksize:
+            self.fact_table = (apply_schema(chunk, source_schema) for chunk in database.stream_blobs_csv(self.source_blobs, chunksize=self.chunksize))
+            print(f"Streaming csv files matching {self.source_blobs} in chunks of {self.chunksize} rows")
+        elif self.source_blobs:
+            self.fact_table = context.get("source", lambda: apply_schema(database.access_blobs_csv(self.source_blobs, self.download_workers, self.parse_workers), source_schema))
+            print(f"We find {len(self.fact_table.index)} rows and {len(self.fact_table.columns)} columns in csv files matching {self.source_blobs}")
+        elif self.chunksize:
+            self.fact_table = (apply_schema(chunk, source_schema) for chunk in database.stream_blob_csv(csv_file, chunksize=self.chunksize))
+            print(f"Streaming csv file: {csv_file} in chunks of {self.chunksize} rows")
+        else:
+            self.fact_table = apply_schema(context.source(database, csv_file), source_schema)
+            print(f"We find {len(self.fact_table.index)} rows and {len(self.fact_table.columns)} columns in csv file: {csv_file}")
+
+    def create_dimensions(self):
+        for dim in [DimCrypto(), DimDate(), DimPriceVariations(), DimPriceDifferential()]:
+            self.drop_columns += dim.columns
+            self.dimension_tables.append(dim)
+
+    def start_from_watermark(self):
+        # Continue from the last successful run: seed the dimensions with their existing members and ids
+        # and number new fact rows after the ones already loaded. Without a watermark this is a full load.
+        watermark = database.read_watermark()
+        if watermark is None:
+            print("No watermark found, running a full load")
+            return
+
+        self.create_dimensions()
         for dim in self.dimension_tables:
-            self.fact_table = pd.merge(self.fact_table, dim.dimension_table, on=dim.columns, how="left")
-        self.fact_table = self.fact_table = self.fact_table.drop(columns=self.drop_columns)
-        
+            existing = database.read_sqldatabase(f"{dim.name}_dim")
+            if existing is None or not dim.seedable(existing):
+                print("Could not read the existing dimensions or they predate this version, running a full load")
+                self.drop_columns, self.dimension_tables = [], []
+                return
+            dim.seed(existing)
+
+        self.watermark = watermark
+        self.fact_rows = watermark["Crypto_Fact_ID"]
+        self.last_month = pd.Timestamp(watermark["Month_Date"])
+        print(f"Loading months after {watermark['Month_Date']}, {self.fact_rows} fact rows already loaded")
+
+    def transform(self):
+        self.fact_table = self.transform_chunk(self.fact_table)
+        # The transformed table replaces the source, so the downloaded copy can be freed
+        context.release("source")
         print(f"Step 2 finished")
-        
+
+    def transform_chunk(self, fact_table):
+        with profiler.stage("transform") as stage:
+            stage.rows = len(fact_table)
+
+            with profiler.stage("dates"):
+                # The yyyymm Date_ID of every row, parsed once per distinct month string, replaces Month_Date
+                month = self.month_lookup(fact_table["Month_Date"])
+                fact_table = fact_table.drop(columns="Month_Date")
+                # Rows without a valid month cannot be keyed on the date dimension, so they are left out
+                keep = month > 0
+                if not keep.all():
+                    print(f"Skipping {int((~keep).sum())} rows without a valid Month_Date")
+                if self.watermark is not None:
+                    # Only months after the watermark are new
+                    keep &= month > month_keys(pd.DatetimeIndex([self.watermark["Month_Date"]]))[0]
+                if not keep.all():
+                    fact_table, month = fact_table[keep].copy(), month[keep]
+                fact_table["Date_ID"] = month
+                if len(month):
+                    latest = key_months([month.max()])[0].to_timestamp()
+                    if self.last_month is None or latest > self.last_month:
+                        self.last_month = latest
+
+            with profiler.stage("astype"):
+                fact_table[["Open_Price", "High_Price", "Low_Price",
+                            "Close_Price", "Change_pct"]] = fact_table[["Open_Price", "High_Price", "Low_Price",
+                                                                        "Close_Price", "Change_pct"]].astype(float)
+
+                fact_table["Volume_Traded"] = convert_volume_series(fact_table["Volume_Traded"])
+                iso = fact_table["ISO_Stdised_Key (PK)"]
+                if isinstance(iso.dtype, pd.CategoricalDtype):
+                    # Only the categories need converting
+                    fact_table["ISO_Stdised_Key (PK)"] = iso.cat.rename_categories(iso.cat.categories.astype(str))
+                else:
+                    fact_table[["ISO_Stdised_Key (PK)"]] = fact_table[["ISO_Stdised_Key (PK)"]].astype(str)
+                fact_table[["Crypto_Key (FK)"]] = fact_table[["Crypto_Key (FK)"]].astype(int)
+                fact_table = apply_schema(fact_table, source_schema)
+
+            if not self.dimension_tables:
+                self.create_dimensions()
+
+            # Look up the surrogate keys of every row through each dimension's key index; later chunks only
+            # add the members the dimensions have not seen yet
+            dimension_columns = []
+            for dim in self.dimension_tables:
+                with profiler.stage(f"keys/{dim.name}") as keys:
+                    dimension_columns.append(dim.attributes(dim.update(fact_table)))
+                    keys.rows = len(fact_table)
+
+            with profiler.stage("assemble"):
+                fact_table = fact_table.drop(columns=self.drop_columns).reset_index(drop=True)
+                fact_table = pd.concat([fact_table] + dimension_columns, axis=1)
+
+                return apply_schema(fact_table, fact_schema)
+
+    def load_fact(self, fact_table):
+        # Upload a block of fact rows; the first block replaces the table, later blocks are appended
+        if self.watermark is not None and not len(fact_table):
+            return
+        fact_table["Crypto_Fact_ID"] = range(self.fact_rows + 1, self.fact_rows + len(fact_table) + 1)
+        fact_table.index = range(self.fact_rows, self.fact_rows + len(fact_table))
+
+        if "Crypto_Fact" in self.failed_tables:
+            # A block already failed; the rest are transformed for the dimensions but neither uploaded nor
+            # staged, so no partial fact table is built on top of the failed one
+            self.fact_rows += len(fact_table)
+            return
+
+        with profiler.stage("load/Crypto_Fact") as stage:
+            stage.rows = len(fact_table)
+            if self.fact_rows == 0:
+                uploaded = database.upload_dataframe_sqldatabase(f"Crypto_Fact", blob_data=fact_table)
+            else:
+                try:
+                    database.append_dataframe_sqldatabase(f"Crypto_Fact", blob_data=fact_table)
+                    uploaded = True
+                except Exception as e:
+                    print(f"Error appending to table Crypto_Fact: {e}")
+                    uploaded = False
+            if not uploaded:
+                self.failed_tables.append("Crypto_Fact")
+                if self.chunksize:
+                    print("Skipping the remaining Crypto_Fact blocks")
+            else:
+                with profiler.stage("staging"):
+                    staging.write("Crypto_Fact", fact_table, partitions=self.fact_months(fact_table), append=self.fact_rows > 0)
+        self.fact_rows += len(fact_table)
+
+    def fact_months(self, fact_table):
+        # Month_Date of every fact row, looked up through the date dimension, to partition the staged fact table
+        dim_date = next(dim for dim in self.dimension_tables if dim.name == "Date")
+        months = dim_date.dimension_table.set_index(dim_date.id_column)["Month_Date"].reindex(fact_table["Date_ID"])
+        return pd.Series(months.to_numpy(), index=fact_table.index, name="Month_Date")
+
+    def load_dimensions(self):
+        # The dimensions do not depend on each other, so upload them concurrently; every worker holds
+        # one pooled connection, so load_workers also bounds the number of open connections
+        with ThreadPoolExecutor(max_workers=self.load_workers) as executor:
+            futures = {executor.submit(self.load_dimension, table): table for table in self.dimension_tables}
+            for future in as_completed(futures):
+                table = futures[future]
+                try:
+                    uploaded = future.result()
+                except Exception as e:
+                    print(f"Error loading {table.name}_dim: {e}")
+                    uploaded = False
+                if not uploaded:
+                    self.failed_tables.append(f"{table.name}_dim")
+
+    def load_dimension(self, table):
+        with profiler.stage(f"load/{table.name}_dim") as stage:
+            stage.rows = len(table.dimension_table) if table.dimension_table is not None else 0
+            return table.load()
+
     def load(self):
-        for table in self.dimension_tables:
-            table.load()
-        with engine.connect() as con:
+        self.load_dimensions()
+        with context.engine.connect() as con:
             trans = con.begin()
-            self.fact_table["Crypto_Fact_ID"] = range(1, len(self.fact_table) + 1)
-            database.upload_dataframe_sqldatabase(f"Crypto_Fact", blob_data=self.fact_table)
-            
-            self.fact_table.to_csv("./data/Crypto_Fact.csv")
-            
-            for table in self.dimension_tables:
-                con.execute(text(f'ALTER TABLE [dbo].[Crypto_Fact] WITH NOCHECK ADD CONSTRAINT [FK_{table.name}_dim] FOREIGN KEY ([{table.name}_id]) REFERENCES [dbo].[{table.name}_dim] ([{table.name}_id]) ON UPDATE CASCADE ON DELETE CASCADE;'))
-            trans.commit()
-            
-        print(f"Step 3 finished")
-        
+            if not self.chunksize:
+                self.load_fact(self.fact_table)
+
+            # Foreign keys go on last, and only between tables that were uploaded; appended tables keep theirs
+            # and staged tables get theirs when they are swapped in
+            with profiler.stage("load/foreign_keys"):
+                for table in self.dimension_tables:
+                    if self.watermark is not None or database.schema_first:
+                        break
+                    if "Crypto_Fact" in self.failed_tables or f"{table.name}_dim" in self.failed_tables:
+                        continue
+                    con.execute(text(f'ALTER TABLE [dbo].[Crypto_Fact] WITH NOCHECK ADD CONSTRAINT [FK_{table.name}_dim] FOREIGN KEY ([{table.name}_id]) REFERENCES [dbo].[{table.name}_dim] ([{table.name}_id]) ON UPDATE CASCADE ON DELETE CASCADE;'))
+                trans.commit()
+
+        if database.staged_tables:
+            if self.failed_tables:
+                # Nothing is swapped in, the live tables stay as they were
+                print(f"Staging tables left unswapped: {', '.join(sorted(database.staged_tables))}")
+            else:
+                with profiler.stage("load/swap"):
+                    if not database.swap_staging_tables():
+                        self.failed_tables.append("staging swap")
+
+        if self.failed_tables:
+            if self.watermark is not None or not database.schema_first:
+                # The tables that did load were replaced or appended in place (only a schema-first full load
+                # leaves the live tables untouched), so the summary tables no longer match them; dropping them
+                # makes the API compute the aggregates from the star schema
+                with profiler.stage("load/aggregates"):
+                    self.drop_aggregates()
+                query_cache.invalidate()
+            print(f"Step 3 finished with failed tables: {', '.join(self.failed_tables)}")
+        else:
+            if self.last_month is not None:
+                database.write_watermark({"Month_Date": self.last_month.strftime("%Y-%m"), "Crypto_Fact_ID": self.fact_rows,
+                                          "Updated": datetime.utcnow().isoformat(timespec="seconds")})
+            with profiler.stage("load/indexes"):
+                self.create_indexes()
+            with profiler.stage("load/aggregates"):
+                self.materialize_aggregates()
+            # The staged tables are a complete copy of the warehouse, the API's DuckDB backend reloads them
+            staging.mark_complete()
+            # The API caches query results until the warehouse changes
+            query_cache.invalidate()
+            print(f"Step 3 finished")
+
+    def create_indexes(self):
+        # Indexes derived from the dashboard queries; a replaced fact table comes without them, an appended one keeps them
+        for statement in index_statements(self.fact_indexes):
+            with database.engine.connect() as con:
+                trans = con.begin()
+                try:
+                    con.execute(text(statement))
+                    trans.commit()
+                except Exception as e:
+                    trans.rollback()
+                    print(f"Error creating index: {e}")
+        print(f"Indexes on Crypto_Fact: {self.fact_indexes}")
+
+    def materialize_aggregates(self):
+        # Precompute the dashboard aggregates so the API does not join the fact table on every request
+        for name in summary_tables:
+            with context.engine.connect() as con:
+                trans = con.begin()
+                try:
+                    for statement in materialize_statements(name):
+                        con.execute(text(statement))
+                    trans.commit()
+                    print(f"Materialized {name}")
+                except Exception as e:
+                    trans.rollback()
+                    print(f"Error materializing {name}: {e}")
+
+    def drop_aggregates(self):
+        for name in summary_tables:
+            with context.engine.connect() as con:
+                trans = con.begin()
+                try:
+                    con.execute(text(drop_statement(name)))
+                    trans.commit()
+                    print(f"Dropped stale {name}")
+                except Exception as e:
+                    trans.rollback()
+                    print(f"Error dropping {name}: {e}")
+
     def mainLoop(self):
-        
+
         self.extract()
-        self.transform()
+        if self.chunksize:
+            # Transform and upload one chunk at a time, so only one chunk of source and fact rows is in memory;
+            # the dimensions still hold every member seen so far (about one row per fact row for the price dimensions)
+            chunks = iter(self.fact_table)
+            while True:
+                # Reading a chunk is the streamed part of the extract
+                with profiler.stage("extract") as stage:
+                    chunk = next(chunks, None)
+                    stage.rows = 0 if chunk is None else len(chunk)
+                if chunk is None:
+                    break
+                self.load_fact(self.transform_chunk(chunk))
+                print(f"Processed {self.fact_rows} rows")
+            print(f"Step 2 finished")
+        else:
+            self.transform()
         self.load()
-        
+
 def main():
-    main = MainETL()
-    main.mainLoop()
+    chunksize = os.environ.get("ETL_CHUNKSIZE")
+    database.bulk_tables = parse_bulk_tables(os.environ.get("ETL_BULK_TABLES", "Crypto_Fact"))
+    database.schema_first = os.environ.get("ETL_SCHEMA_FIRST", "").lower() in ("1", "true", "yes")
+    parse_workers = os.environ.get("ETL_PARSE_WORKERS")
+    main = MainETL(chunksize=int(chunksize) if chunksize else None, load_workers=int(os.environ.get("ETL_LOAD_WORKERS", 4)),
+                   incremental=os.environ.get("ETL_INCREMENTAL", "").lower() in ("1", "true", "yes"),
+                   source_blobs=os.environ.get("ETL_SOURCE_BLOBS"), download_workers=int(os.environ.get("ETL_DOWNLOAD_WORKERS", 8)),
+                   parse_workers=int(parse_workers) if parse_workers else None,
+                   fact_indexes=os.environ.get("ETL_FACT_INDEXES", "rowstore").lower())
+    # ETL_PROFILE_OUTPUT writes the stage profile as JSON, or as Prometheus text for a .prom file
+    profile_output = os.environ.get("ETL_PROFILE_OUTPUT")
+    pstats_path = f"{os.path.splitext(profile_output)[0] if profile_output else './data/etl_profile'}.pstats"
+    test_connection()
+    profiler.run(main.mainLoop, pstats_path=pstats_path)
+    print(f"ETL connection pool: {pool_stats(database.engine)}")
+    profiler.report()
+    if profile_output:
+        profiler.write(profile_output)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
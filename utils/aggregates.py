@@ -0,0 +1,98 @@
+# Aggregates behind the dashboard endpoints. MainETL.load materializes each one into a summary table after
+# the star schema is loaded, so the API reads a few indexed rows instead of joining the whole fact table.
+# The keys are cast to bounded NVARCHAR so they can carry the summary table's clustered index.
+# "fact_joins" and "fact_columns" list the Crypto_Fact columns each query joins on and reads; the loader derives
+# the fact table's indexes from them (utils.warehouse.fact_indexes).
+
+summary_tables = {
+    "Summary_Crypto_Differential": {
+        "query": '''
+            SELECT CAST(CD.[ISO_Stdised_Key (PK)] AS NVARCHAR(64)) AS Crypto,
+                   ROUND(AVG(PD.Price_Differential), 2) AS Avg_Price_Differential,
+                   ROUND(AVG(CF.Change_pct), 4) AS Avg_Percent_Change
+            FROM [dbo].[Crypto_Fact] CF
+            JOIN [dbo].[Crypto_dim] CD ON CF.Crypto_id = CD.Crypto_id
+            JOIN [dbo].[PriceDifferential_dim] PD ON CF.PriceDifferential_id = PD.PriceDifferential_id
+            GROUP BY CD.[ISO_Stdised_Key (PK)]
+        ''',
+        "columns": ["Crypto", "Avg_Price_Differential", "Avg_Percent_Change"],
+        "fact_joins": ["Crypto_id", "PriceDifferential_id"],
+        "fact_columns": ["Change_pct"],
+        "key": ["Crypto"],
+        "order_by": "Avg_Percent_Change DESC",
+    },
+    "Summary_Monthly_Volume": {
+        "query": '''
+            SELECT CAST(CD.[ISO_Stdised_Key (PK)] AS NVARCHAR(64)) AS Crypto,
+                   DD.Date_ID AS Date_ID,
+                   CAST(DD.Month_Date AS NVARCHAR(32)) AS Month_Date,
+                   ROUND(AVG(CD.Volume_Traded), 0) AS Avg_Monthly_Volume
+            FROM [dbo].[Crypto_Fact] CF
+            JOIN [dbo].[Date_dim] DD ON CF.Date_ID = DD.Date_ID
+            JOIN [dbo].[Crypto_dim] CD ON CF.Crypto_id = CD.Crypto_id
+            GROUP BY CD.[ISO_Stdised_Key (PK)], DD.Date_ID, DD.Month_Date
+        ''',
+        "columns": ["Crypto", "Date_ID", "Month_Date", "Avg_Monthly_Volume"],
+        "fact_joins": ["Date_ID", "Crypto_id"],
+        "fact_columns": [],
+        "key": ["Crypto", "Date_ID"],
+        "order_by": "Crypto, Date_ID",
+    },
+    "Summary_Crypto_Variation": {
+        "query": '''
+            SELECT CAST(CD.[ISO_Stdised_Key (PK)] AS NVARCHAR(64)) AS Crypto,
+                   ROUND(AVG(PV.Price_Variation), 2) AS Avg_Variation,
+                   COUNT(*) AS Entry_Count
+            FROM [dbo].[Crypto_Fact] CF
+            JOIN [dbo].[PriceVariations_dim] PV ON CF.PriceVariations_id = PV.PriceVariations_id
+            JOIN [dbo].[Crypto_dim] CD ON CF.Crypto_id = CD.Crypto_id
+            GROUP BY CD.[ISO_Stdised_Key (PK)]
+        ''',
+        "columns": ["Crypto", "Avg_Variation", "Entry_Count"],
+        "fact_joins": ["PriceVariations_id", "Crypto_id"],
+        "fact_columns": [],
+        "key": ["Crypto"],
+        "order_by": "Avg_Variation DESC",
+    },
+    "Summary_Variation_Type": {
+        "query": '''
+            SELECT CAST(PV.Price_Variation_Type AS NVARCHAR(16)) AS Price_Variation_Type,
+                   COUNT(*) AS Frequency
+            FROM [dbo].[Crypto_Fact] CF
+            JOIN [dbo].[PriceVariations_dim] PV ON CF.PriceVariations_id = PV.PriceVariations_id
+            GROUP BY PV.Price_Variation_Type
+        ''',
+        "columns": ["Price_Variation_Type", "Frequency"],
+        "fact_joins": ["PriceVariations_id"],
+        "fact_columns": [],
+        "key": ["Price_Variation_Type"],
+        "order_by": None,
+    },
+}
+
+def order_clause(name):
+    order_by = summary_tables[name]["order_by"]
+    return f" ORDER BY {order_by}" if order_by else ""
+
+def live_query(name):
+    # The aggregate computed from the star schema
+    return summary_tables[name]["query"].rstrip() + order_clause(name) + ";"
+
+def summary_query(name):
+    # The aggregate read back from its summary table
+    columns = ", ".join(summary_tables[name]["columns"])
+    return f"SELECT {columns} FROM [dbo].[{name}]" + order_clause(name) + ";"
+
+def drop_statement(name):
+    # Without its summary table the API computes the aggregate from the star schema
+    return f"DROP TABLE IF EXISTS [dbo].[{name}];"
+
+def materialize_statements(name):
+    # Rebuild the summary table from the star schema and index it on its grouping key
+    key = ", ".join(f"[{column}]" for column in summary_tables[name]["key"])
+    query = summary_tables[name]["query"].strip()
+    return [
+        drop_statement(name),
+        query.replace("FROM [dbo].[Crypto_Fact] CF", f"INTO [dbo].[{name}]\n            FROM [dbo].[Crypto_Fact] CF", 1) + ";",
+        f"CREATE UNIQUE CLUSTERED INDEX [IX_{name}] ON [dbo].[{name}] ({key});",
+    ]
@@ -0,0 +1,122 @@
+import os, re, time, threading
+from functools import lru_cache
+from operator import itemgetter
+from utils.staging import staging as default_staging
+from utils.aggregates import summary_tables, live_query
+from utils.metrics import metrics
+
+# In-process query backend for the API (API_QUERY_BACKEND=duckdb): the star schema the ETL stages in data/
+# is loaded into an in-memory DuckDB database, and the API's T-SQL queries are answered from it instead of
+# Azure SQL. The summary tables are computed at load time like MainETL.materialize_aggregates does. The
+# database is rebuilt when the ETL touches the staging area's completed-load marker, which only a successful
+# load does; queries in flight finish on the previous one. duckdb is only imported when the backend is used.
+
+star_schema = ["Crypto_Fact", "Crypto_dim", "Date_dim", "PriceVariations_dim", "PriceDifferential_dim"]
+
+@lru_cache(maxsize=256)
+def duckdb_sql(query):
+    # T-SQL identifiers in brackets become double-quoted ones; the rest of the dashboard queries is common SQL
+    return re.sub(r"\[([^\]]+)\]", r'"\1"', query)
+
+class AnalyticsEngine():
+    def __init__(self, staging=None):
+        self.staging = staging or default_staging
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.database = None
+        self.marker = None
+        # Marker of a load whose staged tables could not be read; not retried until the marker changes
+        self.failed_marker = -1
+        self.loaded_at = None
+
+    def read_marker(self):
+        return self.staging.completed()
+
+    def staged_mtime(self):
+        # Newest modification time of the staged star schema files; a Parquet table may be a directory
+        newest = 0
+        for name in star_schema:
+            path = self.staging.path(name)
+            files = [os.path.join(root, file) for root, _, names in os.walk(path) for file in names] if os.path.isdir(path) else [path]
+            newest = max([newest] + [os.stat(file).st_mtime_ns for file in files if os.path.exists(file)])
+        return newest
+
+    def refresh(self, marker=None):
+        # Build a new database from the staged tables and swap it in. The ETL writes them before it marks the
+        # load complete, so only tables older than the marker belong to a completed load; newer ones are from
+        # a load still running or one that failed.
+        import duckdb
+        start = time.perf_counter()
+        marker = self.read_marker() if marker is None else marker
+        if marker is None:
+            raise RuntimeError("no ETL load has completed yet")
+        database = duckdb.connect(":memory:")
+        database.execute("CREATE SCHEMA dbo")
+        for name in star_schema:
+            data = self.staging.read(name)
+            database.register("staged", data)
+            database.execute(f'CREATE TABLE dbo."{name}" AS SELECT * FROM staged')
+            database.unregister("staged")
+        if self.staged_mtime() > marker:
+            database.close()
+            raise RuntimeError("the staged tables are newer than the last completed load")
+        for name in summary_tables:
+            database.execute(f'CREATE TABLE dbo."{name}" AS {duckdb_sql(live_query(name)).rstrip(";")}')
+        self.database, self.marker, self.loaded_at = database, marker, time.time()
+        print(f"Analytics database loaded from {self.staging.staging_format} staging in {time.perf_counter() - start:.2f}s")
+
+    def stale(self, marker):
+        return (self.database is None or marker != self.marker) and marker != self.failed_marker
+
+    def cursor(self):
+        # One DuckDB connection per thread, since a connection cannot run two queries at once. A failed
+        # rebuild keeps the previous database and is only retried once the marker changes again.
+        if self.stale(self.read_marker()):
+            with self.lock:
+                # Another thread may have rebuilt it while this one waited
+                marker = self.read_marker()
+                if self.stale(marker):
+                    try:
+                        self.refresh(marker)
+                    except Exception as e:
+                        self.failed_marker = marker
+                        kept = "keeping the previous one" if self.database is not None else "none loaded yet"
+                        print(f"Could not load the analytics database ({kept}): {e}")
+        database = self.database
+        if database is None:
+            raise RuntimeError("The analytics database is not loaded")
+        if getattr(self.local, "database", None) is not database:
+            self.local.database, self.local.cursor = database, database.cursor()
+        return self.local.cursor
+
+    def get_columns(self, query, name="other"):
+        # Column-oriented result like AzureDB.get_sql_columns; None if the query fails
+        start = time.perf_counter()
+        try:
+            result = self.cursor().execute(duckdb_sql(query))
+            columns = [description[0] for description in result.description]
+            rows = result.fetchall()
+        except Exception as e:
+            print(f"Error in analytics query: {e}")
+            metrics.observe_query(name, time.perf_counter() - start, 0)
+            return None
+        metrics.observe_query(name, time.perf_counter() - start, len(rows))
+        return {column: list(map(itemgetter(index), rows)) for index, column in enumerate(columns)}
+
+    def stream_columns(self, statement, name="other", batch_rows=5000):
+        # A SQLAlchemy statement, compiled with "?" placeholders (SQLite's style, which DuckDB shares), yielded
+        # batch_rows at a time like AzureDB.stream_sql_columns
+        from sqlalchemy.dialects import sqlite
+        compiled = statement.compile(dialect=sqlite.dialect(), compile_kwargs={"render_postcompile": True})
+        parameters = [compiled.params[key] for key in compiled.positiontup]
+        start, rows = time.perf_counter(), 0
+        try:
+            result = self.cursor().execute(str(compiled), parameters)
+            columns = [description[0] for description in result.description]
+            while batch := result.fetchmany(batch_rows):
+                rows += len(batch)
+                yield {column: list(map(itemgetter(index), batch)) for index, column in enumerate(columns)}
+            if not rows:
+                yield {column: [] for column in columns}
+        finally:
+            metrics.observe_query(name, time.perf_counter() - start, rows)
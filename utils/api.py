@@ -1,14 +1,25 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Response
+from fastapi import FastAPI, Depends, HTTPException, status, Response, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from pydantic import BaseModel
 from dotenv import load_dotenv
-import os, json
+import os, asyncio, threading
+from itertools import chain
+from typing import Literal, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.middleware.cors import CORSMiddleware
 
 from utils.datasetup import AzureDB
+from utils.cache import query_cache, token_cache
+from utils.pool import pool_stats, warm_pool
+from utils.aggregates import summary_query, live_query
+from utils.metrics import metrics, MetricsMiddleware
+from utils.encoding import encode, media_types, stream_page
+from utils.queries import price_page_query, month_key
 
 load_dotenv()
 
@@ -31,17 +42,19 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["*"]
 )
+# Outermost, so the latency includes the CORS handling
+app.add_middleware(MetricsMiddleware, metrics=metrics)
 
 # Password context
 pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-# Database simulation
+# Database simulation; the argon2 hashes are computed once, ahead of time, instead of at every import
 db_users = {
     "admin": {
         "username": "admin",
         "full_name": "Admin User",
-        "hashed_password": pwd_context.hash("admin123"),
+        "hashed_password": "$argon2id$v=19$m=65536,t=3,p=4$UKp1bq3V+n+P8b43hjAGoA$QPhLx/ZJQSghB4/Rt+BRgS62sMpeLET4rZuoqGLDjyE",
         "roles": ["manager"],
         "id": 0
     },
@@ -49,15 +62,45 @@ db_users = {
     "crypto_user": {
         "username": "crypto_user",
         "full_name": "Crypto Analyst",
-        "hashed_password": pwd_context.hash("user1234"),
+        "hashed_password": "$argon2id$v=19$m=65536,t=3,p=4$l9K69/5fi3FOCeEcw5iT8g$MJyeiGKpAmfds8blSr3umufzY3ncXNlre9pwfbZNztI",
         "roles": ["employee"],
         "id": 1
     },
 }
 
-# SQL database access
-database=AzureDB()
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# argon2 takes a large share of a CPU for a fraction of a second on purpose, so logins are verified on a
+# small pool of threads (argon2 releases the GIL) instead of the event loop; a burst of logins then waits in
+# its queue instead of stalling every other request. Every busy auth thread takes a core, so by default one
+# core is left to the event loop (one thread on a single core, which then shares it)
+auth_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("API_AUTH_WORKERS", max(available_cores() - 1, 1))),
+                                   thread_name_prefix="auth")
+
+# SQL database access, on the API's own connection pool
+database=AzureDB(role="api")
 database.access_container("csvfiles")
+# API_QUERY_BACKEND=duckdb answers the dashboard queries from the tables the ETL stages locally
+if os.environ.get("API_QUERY_BACKEND", "sql").lower() == "duckdb":
+    from utils.analytics import AnalyticsEngine
+    database.query_backend = AnalyticsEngine()
+
+# The SQLAlchemy engine is blocking, so queries run on a bounded pool of threads instead of the event loop;
+# keep this at or below the engine's connection pool size
+sql_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("API_SQL_WORKERS", 8)), thread_name_prefix="sql")
+
+@app.on_event("startup")
+async def open_connections():
+    # Open the pool's connections in the background so the first requests find them ready
+    if os.environ.get("API_SQL_POOL_WARM", "1").lower() in ("1", "true", "yes"):
+        asyncio.get_running_loop().run_in_executor(sql_executor, warm_pool, database.engine)
+    if database.query_backend is not None:
+        # Load the analytics database before the first dashboard request needs it
+        asyncio.get_running_loop().run_in_executor(sql_executor, database.query_backend.cursor)
 
 class Token(BaseModel):
     access_token: str
@@ -71,7 +114,11 @@ class User(BaseModel):
 # Authentication functions
 def authenticate_user(username: str, password: str):
     user = db_users.get(username)
-    if user and pwd_context.verify(password, user['hashed_password']):
+    if not user:
+        return False
+    with metrics.phase("argon2_verify"):
+        verified = pwd_context.verify(password, user['hashed_password'])
+    if verified:
         return user
     return False
 
@@ -88,7 +135,11 @@ def add_cors_headers(response: Response):
     return response
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
-    
+    # Tokens verified in the last API_TOKEN_CACHE_TTL seconds skip the signature check and the user lookup
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -96,17 +147,51 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     )
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with metrics.phase("jwt_decode"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         user_data = db_users.get(username, None)
         if user_data is None:
             raise credentials_exception
-        return User(username=user_data['username'], roles=user_data['roles'], id=user_data['id'])
+        user = User(username=user_data['username'], roles=user_data['roles'], id=user_data['id'])
+        token_cache.set(token, user, payload.get("exp", 0))
+        return user
     except JWTError:
         raise credentials_exception
 
+async def cached_sql_table(query: str, role: str, name: str = "other"):
+    # The warehouse only changes when the ETL runs, so repeated dashboard queries are served from the cache
+    data = query_cache.get(role, query)
+    if data is None:
+        data = await asyncio.get_running_loop().run_in_executor(sql_executor, database.get_sql_columns, query, name)
+        if data and any(data.values()):
+            query_cache.set(role, query, data)
+    return data
+
+async def summary_table(name: str, role: str):
+    # Read the aggregate from the summary table the ETL materializes; compute it from the star schema
+    # if the table is not there yet. A missing table is remembered until the next load, so later requests
+    # go straight to the live query instead of failing first.
+    data = None
+    if not query_cache.failed(name):
+        data = await cached_sql_table(summary_query(name), role, name)
+        if data is None:
+            query_cache.set_failed(name)
+    if not data or not any(data.values()):
+        data = await cached_sql_table(live_query(name), role, f"{name}_live")
+    return data
+
+async def run_summaries(names: list, role: str):
+    # The aggregates of an endpoint are independent, so they are fetched concurrently
+    return await asyncio.gather(*(summary_table(name, role) for name in names))
+
+def encoded_response(results: list, format: str):
+    # Encode the results once, straight into the response body, so FastAPI does not encode them again
+    with metrics.phase("arrow_encode" if format == "arrow" else "json_encode"):
+        return Response(content=encode(results, format), media_type=media_types[format])
+
 def check_user_role(role: str):
     def role_checker(current_user: User = Depends(get_current_user)):
         if role not in current_user.roles:
@@ -117,7 +202,7 @@ def check_user_role(role: str):
 @app.post("/token", response_model=Token)
 async def login_for_access_token(response: Response, form_data: OAuth2PasswordRequestForm = Depends()):
     response = add_cors_headers(response)   
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await asyncio.get_running_loop().run_in_executor(auth_executor, authenticate_user, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -137,65 +222,96 @@ async def home():
     return {"message": "Cryptocurrency ETL API"}
 
 @app.get("/data/employee")
-async def crypto_summary(response: Response, current_user: User = Depends(get_current_user)):
-    response = add_cors_headers(response)
+async def crypto_summary(response: Response, format: Literal["records", "columns", "arrow"] = "records",
+                         current_user: User = Depends(get_current_user)):
     id = current_user.id
 
-    query1 = '''
-        SELECT CD.[ISO_Stdised_Key (PK)] AS Crypto,
-               ROUND(AVG(PD.Price_Differential), 2) AS Avg_Price_Differential,
-               ROUND(AVG(CF.Change_pct), 4) AS Avg_Percent_Change
-        FROM [dbo].[Crypto_Fact] CF
-        JOIN [dbo].[Crypto_dim] CD ON CF.Crypto_id = CD.Crypto_id
-        JOIN [dbo].[PriceDifferential_dim] PD ON CF.PriceDifferential_id = PD.PriceDifferential_id
-        GROUP BY CD.[ISO_Stdised_Key (PK)]
-        ORDER BY Avg_Percent_Change DESC;
-    '''
-
-    query2 = '''
-        SELECT CD.[ISO_Stdised_Key (PK)] AS Crypto,
-               DD.Month_Date,
-               ROUND(AVG(CD.Volume_Traded), 0) AS Avg_Monthly_Volume
-        FROM [dbo].[Crypto_Fact] CF
-        JOIN [dbo].[Date_dim] DD ON CF.Date_ID = DD.Date_ID
-        JOIN [dbo].[Crypto_dim] CD ON CF.Crypto_id = CD.Crypto_id
-        GROUP BY CD.[ISO_Stdised_Key (PK)], DD.Month_Date
-        ORDER BY CD.[ISO_Stdised_Key (PK)], DD.Month_Date;
-    '''
-
-    queries = [query1, query2]
-    return json.dumps([database.get_sql_table(q) for q in queries])
+    summaries = ["Summary_Crypto_Differential", "Summary_Monthly_Volume"]
+    return add_cors_headers(encoded_response(await run_summaries(summaries, "employee"), format))
 
 
 @app.get("/data/manager")
-async def market_overview(response: Response, current_user: User = Depends(check_user_role("manager"))):
-    response = add_cors_headers(response)
+async def market_overview(response: Response, format: Literal["records", "columns", "arrow"] = "records",
+                          current_user: User = Depends(check_user_role("manager"))):
     id = current_user.id
 
-    query3 = '''
-        SELECT CD.[ISO_Stdised_Key (PK)] AS Crypto,
-               ROUND(AVG(PV.Price_Variation), 2) AS Avg_Variation,
-               COUNT(*) AS Entry_Count
-        FROM [dbo].[Crypto_Fact] CF
-        JOIN [dbo].[PriceVariations_dim] PV ON CF.PriceVariations_id = PV.PriceVariations_id
-        JOIN [dbo].[Crypto_dim] CD ON CF.Crypto_id = CD.Crypto_id
-        GROUP BY CD.[ISO_Stdised_Key (PK)]
-        ORDER BY Avg_Variation DESC;
-    '''
-
-    query4 = '''
-        SELECT PV.Price_Variation_Type,
-               COUNT(*) AS Frequency
-        FROM [dbo].[Crypto_Fact] CF
-        JOIN [dbo].[PriceVariations_dim] PV ON CF.PriceVariations_id = PV.PriceVariations_id
-        GROUP BY PV.Price_Variation_Type;
-    '''
-
-    queries = [query3, query4]
-    return json.dumps([database.get_sql_table(q) for q in queries])
+    summaries = ["Summary_Crypto_Variation", "Summary_Variation_Type"]
+    return add_cors_headers(encoded_response(await run_summaries(summaries, "manager"), format))
+
+class ExecutorStream():
+    # Response body of a blocking generator of chunks, advanced on sql_executor so a streamed page counts
+    # against API_SQL_WORKERS like the other queries. close() runs as the response's background task, which
+    # Starlette also runs after a client disconnects, so the generators give their pooled connection back
+    # straight away instead of when they are garbage collected. The lock keeps close() from running while
+    # a chunk is being fetched.
+
+    def __init__(self, chunks, *generators):
+        self.chunks = chunks
+        self.generators = (chunks,) + generators
+        self.lock = threading.Lock()
+
+    def next_chunk(self):
+        with self.lock:
+            return next(self.chunks, None)
+
+    def close_generators(self):
+        with self.lock:
+            for generator in self.generators:
+                generator.close()
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        while (chunk := await loop.run_in_executor(sql_executor, self.next_chunk)) is not None:
+            yield chunk
+
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(sql_executor, self.close_generators)
+
+# Largest page of /query/prices; a page holds one SQL connection while it streams
+max_page_rows = int(os.environ.get("API_QUERY_MAX_ROWS", 10000))
+
+@app.get("/query/prices")
+async def query_prices(symbol: Optional[List[str]] = Query(None, max_length=64),
+                       start: Optional[str] = Query(None, pattern=r"^\d{4}-(0[1-9]|1[0-2])$"),
+                       end: Optional[str] = Query(None, pattern=r"^\d{4}-(0[1-9]|1[0-2])$"),
+                       after: Optional[int] = None, limit: int = Query(1000, ge=1),
+                       format: Literal["records", "arrow"] = "records",
+                       current_user: User = Depends(get_current_user)):
+    # Fact rows of the given symbols and months (start and end as YYYY-MM, both included), one keyset page at
+    # a time: pass the "next" of a page as after to get the following one. Rows stream from the cursor in batches.
+    limit = min(limit, max_page_rows)
+    start, end = month_key(start) if start else None, month_key(end) if end else None
+    batches = database.stream_sql_columns(price_page_query(symbol, start, end, after, limit), "prices")
+    # The query runs before the response starts, so a failure is still an error status
+    try:
+        first = await asyncio.get_running_loop().run_in_executor(sql_executor, next, batches)
+    except Exception as e:
+        print(f"Error in query_prices: {e}")
+        await asyncio.get_running_loop().run_in_executor(sql_executor, batches.close)
+        raise HTTPException(status_code=503, detail="Query failed")
+    body = ExecutorStream(stream_page(chain([first], batches), format, "Crypto_Fact_ID", limit), batches)
+    return add_cors_headers(StreamingResponse(body, media_type=media_types[format], background=BackgroundTask(body.close)))
+
+@app.get("/cache/stats")
+async def cache_stats(response: Response, current_user: User = Depends(check_user_role("manager"))):
+    response = add_cors_headers(response)
+    return {**query_cache.stats(), "tokens": token_cache.stats()}
+
+@app.get("/pool/stats")
+async def connection_pool_stats(response: Response, current_user: User = Depends(check_user_role("manager"))):
+    response = add_cors_headers(response)
+    return pool_stats(database.engine)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    # Prometheus text format, for a scraper on the internal network
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
     
-# Running the app with Uvicorn
+# Running the app with Uvicorn; API_WORKERS > 1 starts that many worker processes, each with its own engine,
+# connection pool and executors (set QUERY_CACHE_SHARED=true so they share query results)
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, port=8000)
\ No newline at end of file
+    uvicorn.run("utils.api:app", port=8000, workers=int(os.environ.get("API_WORKERS", 1)))
\ No newline at end of file
@@ -0,0 +1,51 @@
+import re
+import pandas as pd
+from sqlalchemy import event
+from sqlalchemy.types import BigInteger, Float, NVARCHAR
+
+default_batch_size = 10000
+default_text_length = 255
+
+def parse_bulk_tables(value):
+    # "Crypto_Fact=50000,Crypto_dim" -> {"Crypto_Fact": 50000, "Crypto_dim": 10000}
+    bulk_tables = {}
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        table_name, _, batch_size = item.partition("=")
+        bulk_tables[table_name.strip()] = int(batch_size) if batch_size else default_batch_size
+    return bulk_tables
+
+def declared_length(table_name, column):
+    # Length of the column's NVARCHAR type in the table's final definition (utils.warehouse), if it has one
+    from utils.warehouse import table_definitions
+    declared = table_definitions.get(table_name, {}).get("columns", {}).get(column, "")
+    match = re.match(r"NVARCHAR\((\d+)\)", declared)
+    return int(match.group(1)) if match else None
+
+def sql_column_types(data: pd.DataFrame, table_name=None):
+    # Explicit column types so to_sql does not fall back to NVARCHAR(max), which defeats fast_executemany.
+    # Text columns take their declared width, or a fixed NVARCHAR(255), never the longest value of the
+    # block: the first block creates the table and later blocks are appended to it.
+    types = {}
+    for column, dtype in data.dtypes.items():
+        if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+            types[column] = BigInteger()
+        elif pd.api.types.is_float_dtype(dtype):
+            types[column] = Float(53)
+        else:
+            types[column] = NVARCHAR(declared_length(table_name, column) or default_text_length)
+    return types
+
+def enable_fast_executemany(engine):
+    # pyodbc sends executemany batches as one parameter array when fast_executemany is set on the cursor;
+    # it is switched on per statement through the fast_executemany execution option
+    @event.listens_for(engine, "before_cursor_execute")
+    def set_fast_executemany(conn, cursor, statement, parameters, context, executemany):
+        if executemany and context.execution_options.get("fast_executemany") and hasattr(cursor, "fast_executemany"):
+            cursor.fast_executemany = True
+
+def bulk_insert(data: pd.DataFrame, table_name, engine, if_exists="append", batch_size=default_batch_size, dtype=None,
+                definition=None):
+    # definition names the table in utils.warehouse whose column widths apply (a staging copy's live table)
+    with engine.begin() as con:
+        data.to_sql(table_name, con.execution_options(fast_executemany=True), if_exists=if_exists, index=False,
+                    chunksize=batch_size, dtype=dtype or sql_column_types(data, definition or table_name))
@@ -0,0 +1,244 @@
+import os, time, pickle, sqlite3, hashlib, threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class SharedStore():
+    # Query results shared by every API worker process on the machine, in a SQLite file (WAL mode, so readers
+    # do not wait for writers). Entries are pickled; expired entries and, beyond maxsize, those closest to
+    # expiring are removed when a new one is written. Each process and thread opens its own connection.
+
+    def __init__(self, path, maxsize=128):
+        self.path = path
+        self.maxsize = maxsize
+        self.local = threading.local()
+
+    def connection(self):
+        con = getattr(self.local, "con", None)
+        if con is None or self.local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            con = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, expires REAL, data BLOB)")
+            con.execute("CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)")
+            self.local.con, self.local.pid = con, os.getpid()
+        return con
+
+    def get(self, key):
+        # (data, expiry in seconds since the epoch), or None
+        try:
+            row = self.connection().execute("SELECT data, expires FROM entries WHERE key = ? AND expires > ?",
+                                            (key, time.time())).fetchone()
+        except sqlite3.Error as e:
+            print(f"Shared query cache read failed: {e}")
+            return None
+        return (pickle.loads(row[0]), row[1]) if row else None
+
+    def set(self, key, data, expires):
+        try:
+            con = self.connection()
+            con.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                        (key, expires, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)))
+            con.execute("DELETE FROM entries WHERE expires <= ? OR key IN "
+                        "(SELECT key FROM entries ORDER BY expires DESC LIMIT -1 OFFSET ?)", (time.time(), self.maxsize))
+        except sqlite3.Error as e:
+            print(f"Shared query cache write failed: {e}")
+
+    def clear(self):
+        try:
+            self.connection().execute("DELETE FROM entries")
+        except sqlite3.Error as e:
+            print(f"Shared query cache clear failed: {e}")
+
+class QueryCache():
+    # Result cache for the API's SQL queries, keyed by (role, query text). Entries expire after ttl seconds
+    # and the least recently used entry is evicted beyond maxsize. The warehouse only changes when the ETL
+    # runs, so the ETL calls invalidate() after a successful load; it also touches marker_path, which lets
+    # an API running in another process notice the load and drop its entries too.
+    # With a shared store, results missing from this process are looked up there before querying SQL, so API
+    # workers reuse each other's results; the store's keys include the marker, so a load retires them too.
+
+    def __init__(self, maxsize=128, ttl=300, marker_path="./data/query_cache.marker", shared=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.marker_path = marker_path
+        self.shared = shared
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Names of queries known to fail (e.g. a summary table that is not there), until the next load
+        self.failures = set()
+        self.marker = self.read_marker()
+
+    def read_marker(self):
+        try:
+            return os.stat(self.marker_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def shared_key(self, role, query):
+        return hashlib.sha256(f"{self.marker}\0{role}\0{query}".encode()).digest()
+
+    def check_marker(self):
+        # Called with the lock held: a load in another process retires every entry and failure
+        marker = self.read_marker()
+        if marker != self.marker:
+            self.entries.clear()
+            self.failures.clear()
+            self.marker = marker
+            self.invalidations += 1
+
+    def get(self, role, query):
+        with self.lock:
+            self.check_marker()
+
+            entry = self.entries.get((role, query))
+            if entry is not None and entry[0] >= time.monotonic():
+                self.entries.move_to_end((role, query))
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[(role, query)]
+            if self.shared is None or self.maxsize <= 0:
+                self.misses += 1
+                return None
+            key = self.shared_key(role, query)
+
+        shared = self.shared.get(key)
+        with self.lock:
+            if shared is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+        # Kept in this process too, until the shared entry expires
+        self.set(role, query, shared[0], ttl=shared[1] - time.time(), share=False)
+        return shared[0]
+
+    def set(self, role, query, data, ttl=None, share=True):
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            self.entries[(role, query)] = (time.monotonic() + ttl, data)
+            self.entries.move_to_end((role, query))
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            key = self.shared_key(role, query) if share and self.shared is not None and self.maxsize > 0 else None
+        if key is not None:
+            self.shared.set(key, data, time.time() + ttl)
+
+    def failed(self, name):
+        with self.lock:
+            self.check_marker()
+            return name in self.failures
+
+    def set_failed(self, name):
+        with self.lock:
+            self.failures.add(name)
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.failures.clear()
+            self.invalidations += 1
+        if self.shared is not None:
+            self.shared.clear()
+        try:
+            os.makedirs(os.path.dirname(self.marker_path) or ".", exist_ok=True)
+            with open(self.marker_path, "a"):
+                os.utime(self.marker_path)
+        except OSError as e:
+            print(f"Could not touch cache marker {self.marker_path}: {e}")
+        with self.lock:
+            self.marker = self.read_marker()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self.entries),
+                "failed_queries": sorted(self.failures),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+            }
+
+# QUERY_CACHE_SHARED=true shares the results between the processes of a multi-worker API
+query_cache = QueryCache(maxsize=int(os.environ.get("QUERY_CACHE_SIZE", 128)),
+                         ttl=float(os.environ.get("QUERY_CACHE_TTL", 300)),
+                         shared=SharedStore("./data/query_cache.db", int(os.environ.get("QUERY_CACHE_SIZE", 128)))
+                         if os.environ.get("QUERY_CACHE_SHARED", "").lower() in ("1", "true", "yes") else None)
+
+class TokenCache():
+    # Users of JWTs that were already verified, keyed by the token's SHA-256 digest so the tokens themselves
+    # are not kept. An entry expires after ttl seconds or when its token does, whichever comes first; when the
+    # cache is full, expired entries are dropped before the least recently used one.
+
+    def __init__(self, maxsize=4096, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        key = self.digest(token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, token, user, expires_at):
+        # expires_at is the token's "exp" claim, in seconds since the epoch
+        if self.maxsize <= 0:
+            return
+        key = self.digest(token)
+        now = time.time()
+        with self.lock:
+            self.entries[key] = (min(expires_at, now + self.ttl), user)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                for expired in [stale for stale, entry in self.entries.items() if entry[0] <= now]:
+                    del self.entries[expired]
+                    self.evictions += 1
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+            }
+
+token_cache = TokenCache(maxsize=int(os.environ.get("API_TOKEN_CACHE_SIZE", 4096)),
+                         ttl=float(os.environ.get("API_TOKEN_CACHE_TTL", 60)))
@@ -1,4 +1,6 @@
-import os
+import os, json, time, threading, fnmatch
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from operator import itemgetter
 import pyodbc
 from azure.identity import DefaultAzureCredential
 from azure.storage.blob import BlobServiceClient
@@ -7,48 +9,195 @@ from dotenv import load_dotenv
 from sqlalchemy import create_engine, text
 import pandas as pd
 import urllib.parse
+from utils.bulkload import bulk_insert, enable_fast_executemany
+from utils.pool import pool_settings
+from utils.extract_cache import ExtractCache
+from utils.profiler import profiler
+from utils.metrics import metrics
+from utils.warehouse import table_definitions, staging_name, create_staging_statements, swap_statements
 
 load_dotenv()
 
-username = os.environ.get("USERNAME_AZURE")
-password = urllib.parse.quote_plus(os.environ.get("PASSWORD"))
-server = os.environ.get("SERVER")
-database = os.environ.get("DATABASE")
-account_storage = os.environ.get("ACCOUNT_STORAGE")
+def create_sql_engine(role="etl"):
+    # Settings are read when the engine is first needed, not when the module is imported; every role
+    # ("api" reads, "etl" writes) gets its own connection pool
+    username = os.environ.get("USERNAME_AZURE")
+    password = urllib.parse.quote_plus(os.environ.get("PASSWORD", ""))
+    server = os.environ.get("SERVER")
+    database = os.environ.get("DATABASE")
 
-odbc_str = (
-    f"mssql+pyodbc://{username}:{password}"
-    f"@{server}:1433/{database}"
-    f"?driver=ODBC+Driver+18+for+SQL+Server"
-    f"&Encrypt=yes&TrustServerCertificate=no&Connection Timeout=30"
-)
+    odbc_str = (
+        f"mssql+pyodbc://{username}:{password}"
+        f"@{server}:1433/{database}"
+        f"?driver=ODBC+Driver+18+for+SQL+Server"
+        f"&Encrypt=yes&TrustServerCertificate=no&Connection Timeout=30"
+    )
 
-engine = create_engine(odbc_str)
+    engine = create_engine(odbc_str, **pool_settings(role))
+    enable_fast_executemany(engine)
+    return engine
 
-# Test the connection
-try:
-    with engine.connect() as connection:
-        print("SQLAlchemy connection successful!")
-except Exception as e:
-    print(f"Connection failed: {e}")
+class LazyContext():
+    # Registry of the shared resources (SQL engine, blob clients, source DataFrames). Nothing is created
+    # on import; every resource is built by its factory the first time it is asked for and reused after.
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.resources = {}
+        # Bumped when resources are dropped, so objects holding one know to ask again
+        self.generation = 0
+
+    def get(self, key, factory):
+        resource = self.resources.get(key)
+        if resource is None:
+            with self.lock:
+                resource = self.resources.get(key)
+                if resource is None:
+                    resource = factory()
+                    self.resources[key] = resource
+        return resource
+
+    def set(self, key, resource):
+        with self.lock:
+            self.resources[key] = resource
+
+    def release(self, key):
+        with self.lock:
+            return self.resources.pop(key, None)
+
+    def reset(self):
+        # Forget every resource, e.g. in a child process that must not share its parent's connections
+        with self.lock:
+            self.resources.clear()
+            self.generation += 1
+
+    def after_fork(self):
+        # In a forked worker (e.g. gunicorn with preload_app) the engines are kept but their pooled connections,
+        # which still belong to the parent, are dropped without being closed; blob clients and their sessions
+        # are rebuilt on first use
+        self.lock = threading.RLock()
+        engines = {key: engine for key, engine in self.resources.items() if isinstance(key, tuple) and key[0] == "engine"}
+        for engine in set(engines.values()):
+            engine.dispose(close=False)
+        self.resources = engines
+        self.generation += 1
+
+    def engines(self):
+        with self.lock:
+            return {key[1]: engine for key, engine in self.resources.items() if isinstance(key, tuple) and key[0] == "engine"}
+
+    def engine_for(self, role="etl"):
+        return self.get(("engine", role), lambda: create_sql_engine(role))
+
+    @property
+    def engine(self):
+        return self.engine_for("etl")
+
+    @engine.setter
+    def engine(self, engine):
+        # Use one engine for every role, e.g. a local stand-in for the warehouse
+        for role in ("api", "etl"):
+            self.set(("engine", role), engine)
+
+    def blob_service_client(self, account_url):
+        return self.get(("blob", account_url),
+                        lambda: BlobServiceClient(account_url, credential=DefaultAzureCredential()))
+
+    def source(self, database, blob_name):
+        # The source CSV, downloaded once; release("source") frees it when it is no longer needed
+        return self.get("source", lambda: database.access_blob_csv(blob_name))
+
+context = LazyContext()
+os.register_at_fork(after_in_child=context.after_fork)
+
+def test_connection():
+    try:
+        with context.engine.connect() as connection:
+            print("SQLAlchemy connection successful!")
+            return True
+    except Exception as e:
+        print(f"Connection failed: {e}")
+        return False
+
+class BlobChunkReader(io.RawIOBase):
+    # File-like view over the byte chunks returned by StorageStreamDownloader.chunks()
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not len(self.buffer):
+            try:
+                self.buffer = memoryview(next(self.chunks))
+            except StopIteration:
+                return 0
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+def parse_csv(data: bytes):
+    # Runs in the extract's worker processes, so it has to be a module level function
+    return pd.read_csv(io.BytesIO(data))
 
 class AzureDB:
-    def __init__(self, local_path="./data", account_storage=account_storage):
+    def __init__(self, local_path="./data", account_storage=None, bulk_tables=None, role="etl"):
         self.local_path = local_path
-        self.account_url = f"https://{account_storage}.blob.core.windows.net"
-        self.default_credentials = DefaultAzureCredential()
-        self.blob_service_client = BlobServiceClient(self.account_url, credential=self.default_credentials)
-        
+        # Connection pool the instance's queries run on: "api" for reads, "etl" for loads
+        self.role = role
+        # Tables loaded through the bulk path, mapped to their insert batch size
+        self.bulk_tables = bulk_tables or {}
+        # Load replaced tables into staging copies created with their final keys and swap them in at the end
+        self.schema_first = False
+        self.staged_tables = set()
+        # Answers get_sql_table and get_sql_columns instead of the SQL database when set (utils.analytics)
+        self.query_backend = None
+        self.account_storage = account_storage
+        self.container_name = None
+        self._container_client = None
+        self._container_generation = context.generation
+        # Parsed copies of unchanged source blobs (ETL_EXTRACT_CACHE_MB, 0 turns it off)
+        self.extract_cache = ExtractCache(os.path.join(local_path, "extract_cache"),
+                                          int(float(os.environ.get("ETL_EXTRACT_CACHE_MB", 1024)) * 1024 * 1024))
+
+    @property
+    def engine(self):
+        return context.engine_for(self.role)
+
+    @property
+    def account_url(self):
+        account_storage = self.account_storage or os.environ.get("ACCOUNT_STORAGE")
+        return f"https://{account_storage}.blob.core.windows.net"
+
+    @property
+    def blob_service_client(self):
+        return context.blob_service_client(self.account_url)
+
+    @property
+    def container_client(self):
+        # The container is created or opened on first use
+        if self._container_client is None or self._container_generation != context.generation:
+            self._container_client = context.get(("container", self.account_url, self.container_name), self.open_container)
+            self._container_generation = context.generation
+        return self._container_client
+
     def access_container(self, container_name):
+        self.container_name = container_name
+        self._container_client = None
+
+    def open_container(self):
+        container_name = self.container_name
         try:
-            self.container_client = self.blob_service_client.create_container(container_name)
+            container_client = self.blob_service_client.create_container(container_name)
             print(f"Creating container {container_name} since it does not exist in database")
-            self.container_name = container_name
         except Exception as ex:
             print(f"Accessing container {container_name}")
-            self.container_client = self.blob_service_client.get_container_client(container=container_name)
-            self.container_name = container_name
-            
+            container_client = self.blob_service_client.get_container_client(container=container_name)
+        return container_client
+
     def delete_container(self):
         print("Deleting blob container...")
         self.container_client.delete_container()
@@ -83,16 +232,105 @@ class AzureDB:
         blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
         blob_client.delete_blob()
         
+    def blob_properties(self, blob_name):
+        # ETag, last modified time and content MD5 of a blob, the key of its extract cache entry
+        try:
+            return self.container_client.get_blob_client(blob_name).get_blob_properties()
+        except Exception as ex:
+            print(f"Could not read the properties of blob {blob_name}: {ex}")
+            return None
+
     def access_blob_csv(self, blob_name):
         try:
-            print(f"Accessing blob {blob_name}")
-            df = pd.read_csv(io.StringIO(self.container_client.download_blob(blob_name).readall().decode('utf-8')))
+            properties = self.blob_properties(blob_name)
+            df = self.extract_cache.get(blob_name, properties)
+            if df is None:
+                print(f"Accessing blob {blob_name}")
+                with profiler.stage("download") as stage:
+                    data = self.container_client.download_blob(blob_name).readall()
+                    stage.bytes = len(data)
+                with profiler.stage("parse") as stage:
+                    df = pd.read_csv(io.StringIO(data.decode('utf-8')))
+                    stage.rows, stage.bytes = len(df), len(data)
+                self.extract_cache.put(blob_name, properties, df)
             return df
         except Exception as ex:
             print('Exception:')
             print(ex)
             return None
-            
+
+    def list_matching_blobs(self, pattern):
+        # Blobs matching a prefix ("exchanges/2024-") or a glob ("exchanges/*/2024-*.csv"); only the part
+        # before the first wildcard is sent to the service as the listing prefix
+        prefix = pattern
+        for wildcard in "*?[":
+            prefix = prefix.split(wildcard)[0]
+        blobs = list(self.container_client.list_blobs(name_starts_with=prefix))
+        if prefix != pattern:
+            blobs = [blob for blob in blobs if fnmatch.fnmatchcase(blob.name, pattern)]
+        return sorted(blobs, key=lambda blob: blob.name)
+
+    def list_blob_names(self, pattern):
+        return [blob.name for blob in self.list_matching_blobs(pattern)]
+
+    def download_blob_bytes(self, blob_name, max_concurrency=1):
+        return self.container_client.download_blob(blob_name, max_concurrency=max_concurrency).readall()
+
+    def access_blobs_csv(self, pattern, download_workers=8, parse_workers=None):
+        # Download every matching blob on a thread pool and parse each one in a process pool as soon as its
+        # bytes arrive, then concatenate them in blob name order. The listing carries every blob's ETag, so
+        # unchanged blobs are read from the extract cache instead.
+        blobs = self.list_matching_blobs(pattern)
+        if not blobs:
+            print(f"No blobs match {pattern}")
+            return None
+        print(f"Accessing {len(blobs)} blobs matching {pattern}")
+
+        frames = [self.extract_cache.get(blob.name, blob) for blob in blobs]
+        changed = [blob for blob, frame in zip(blobs, frames) if frame is None]
+        if not changed:
+            return pd.concat(frames, ignore_index=True)
+
+        parse_workers = min(parse_workers or os.cpu_count() or 1, len(changed))
+        # With fewer blobs than download threads, split each blob into concurrent ranged downloads instead
+        max_concurrency = max(1, download_workers // len(changed))
+        try:
+            if parse_workers == 1:
+                # One parser: parse in the download threads and skip shipping the bytes to another process
+                with ThreadPoolExecutor(max_workers=download_workers) as downloads:
+                    parsed = list(downloads.map(lambda blob: parse_csv(self.download_blob_bytes(blob.name, max_concurrency)), changed))
+            else:
+                with ProcessPoolExecutor(max_workers=parse_workers) as parsers:
+                    # Start the parser processes before any download thread exists, they are forked from this one
+                    parsers.submit(int).result()
+                    with ThreadPoolExecutor(max_workers=download_workers) as downloads:
+                        futures = list(downloads.map(lambda blob: parsers.submit(parse_csv, self.download_blob_bytes(blob.name, max_concurrency)), changed))
+                    parsed = [future.result() for future in futures]
+        except Exception as ex:
+            print('Exception:')
+            print(ex)
+            return None
+
+        for blob, frame in zip(changed, parsed):
+            self.extract_cache.put(blob.name, blob, frame)
+        parsed = iter(parsed)
+        return pd.concat([frame if frame is not None else next(parsed) for frame in frames], ignore_index=True)
+
+    def stream_blobs_csv(self, pattern, chunksize=100000):
+        # Chunked mode over several blobs: stream them one after the other
+        for blob_name in self.list_blob_names(pattern):
+            yield from self.stream_blob_csv(blob_name, chunksize=chunksize)
+
+    def stream_blob_csv(self, blob_name, chunksize=100000):
+        # Read the blob through ranged downloads and yield DataFrames of at most chunksize rows,
+        # so neither the raw bytes nor the decoded text of the whole file are held in memory
+        print(f"Streaming blob {blob_name} in chunks of {chunksize} rows")
+        downloader = self.container_client.download_blob(blob_name)
+        reader = io.BufferedReader(BlobChunkReader(downloader.chunks()))
+        with pd.read_csv(reader, chunksize=chunksize, encoding="utf-8") as chunks:
+            for chunk in chunks:
+                yield chunk
+
     # def upload_dataframe_sqldatabase(self, blob_name, blob_data):
     #     print("\nUploading to Azure SQL server as table:\n\t" + blob_name)
     #     blob_data.to_sql(blob_name, engine, if_exists="replace", index=False)
@@ -113,17 +351,19 @@ class AzureDB:
     #             print(f"Error setting primary key: {e}")
     
     def upload_dataframe_sqldatabase(self, blob_name, blob_data):
+        if self.schema_first and blob_name in table_definitions:
+            return self.stage_dataframe_sqldatabase(blob_name, blob_data)
         print("\nUploading to Azure SQL server as table:\n\t" + blob_name)
         
         # Name of the table in SQL Server
         table_name = f"[dbo].[{blob_name}]"
         primary = blob_name.replace("dim", "id")
         
-        with engine.connect() as con:
+        with self.engine.connect() as con:
             trans = con.begin()
             try:
                 
-                blob_data.to_sql(blob_name, engine, if_exists="replace", index=False)
+                self.write_dataframe_sqldatabase(blob_name, blob_data, if_exists="replace")
                 
                 # Set primary key constraint
                 if "fact" in blob_name.lower():
@@ -134,17 +374,61 @@ class AzureDB:
                     con.execute(text(f"ALTER TABLE [dbo].[{blob_name}] ADD CONSTRAINT [PK_{blob_name}] PRIMARY KEY CLUSTERED ([{primary}] ASC);"))
                 
                 trans.commit()
+                return True
                 
             except Exception as e:
                 trans.rollback()
                 print(f"Error uploading table {blob_name}: {e}")
+                return False
+
+    def stage_dataframe_sqldatabase(self, blob_name, blob_data):
+        # Schema-first replacement of a table: create its staging copy and load the rows into it
+        table_name = staging_name(blob_name)
+        print("\nUploading to Azure SQL server as staging table:\n\t" + table_name)
+        try:
+            with self.engine.begin() as con:
+                for statement in create_staging_statements(blob_name):
+                    con.execute(text(statement))
+            self.write_dataframe_sqldatabase(blob_name, blob_data, if_exists="append", table_name=table_name)
+            self.staged_tables.add(blob_name)
+            return True
+        except Exception as e:
+            print(f"Error uploading table {table_name}: {e}")
+            return False
+
+    def swap_staging_tables(self):
+        # Rename every staged table in place of the live one in a single transaction
+        names = sorted(self.staged_tables)
+        print(f"\nSwapping in staging tables: {', '.join(names)}")
+        try:
+            with self.engine.begin() as con:
+                for statement in swap_statements(names):
+                    con.execute(text(statement))
+            self.staged_tables.clear()
+            return True
+        except Exception as e:
+            print(f"Error swapping in staging tables: {e}")
+            return False
 
     def append_dataframe_sqldatabase(self, blob_name, blob_data):
-        print("\nAppending to table:\n\t" + blob_name)
-        blob_data.to_sql(blob_name, engine, if_exists="append", index=False)
+        # A table being replaced through its staging copy is appended to there
+        table_name = staging_name(blob_name) if blob_name in self.staged_tables else blob_name
+        print("\nAppending to table:\n\t" + table_name)
+        self.write_dataframe_sqldatabase(blob_name, blob_data, if_exists="append", table_name=table_name)
+
+    def write_dataframe_sqldatabase(self, blob_name, blob_data, if_exists, table_name=None):
+        table_name = table_name or blob_name
+        with profiler.stage("to_sql") as stage:
+            stage.rows, stage.bytes = len(blob_data), int(blob_data.memory_usage(deep=True).sum())
+            if blob_name in self.bulk_tables:
+                # fast_executemany, fixed batch size and explicit column types
+                bulk_insert(blob_data, table_name, self.engine, if_exists=if_exists, batch_size=self.bulk_tables[blob_name],
+                            definition=blob_name)
+            else:
+                blob_data.to_sql(table_name, self.engine, if_exists=if_exists, index=False)
         
     def delete_sqldatabase(self, table_name):
-        with engine.connect() as con:
+        with self.engine.connect() as con:
             trans = con.begin()
             try:
                 con.execute(text(f"DROP TABLE [dbo].[{table_name}]"))
@@ -154,15 +438,88 @@ class AzureDB:
                 trans.rollback()
                 print(f"Error deleting table: {e}")
                 
-    def get_sql_table(self, query):
-        
+    def read_sqldatabase(self, table_name):
         try:
-            with engine.connect() as conn:
-                result = conn.execute(text(query))
-                columns = result.keys()
-                data = [dict(zip(columns, row)) for row in result.fetchall()]
+            return pd.read_sql(text(f"SELECT * FROM [dbo].[{table_name}]"), self.engine)
+        except Exception as e:
+            print(f"Error reading table {table_name}: {e}")
+            return None
+
+    def read_watermark(self, name="etl_watermark.json"):
+        watermark_path = os.path.join(self.local_path, name)
+        if not os.path.exists(watermark_path):
+            return None
+        with open(watermark_path) as watermark_file:
+            return json.load(watermark_file)
+
+    def write_watermark(self, watermark, name="etl_watermark.json"):
+        with open(os.path.join(self.local_path, name), "w") as watermark_file:
+            json.dump(watermark, watermark_file, indent=2)
+
+    def get_sql_table(self, query, name="other"):
+        # name labels the query's timings and row count in the API metrics
+        if self.query_backend is not None:
+            columns = self.query_backend.get_columns(query, name)
+            return [dict(zip(columns, row)) for row in zip(*columns.values())] if columns else []
+        start = time.perf_counter()
+        try:
+            with self.engine.connect() as conn:
+                with metrics.phase("sql_execute"):
+                    result = conn.execute(text(query))
+                    rows = result.fetchall()
+                with metrics.phase("sql_rows_to_dict"):
+                    columns = result.keys()
+                    data = [dict(zip(columns, row)) for row in rows]
+                metrics.observe_query(name, time.perf_counter() - start, len(data))
                 return data
         
         except Exception as e:
             print(f"Error in get_sql_table: {e}")
+            metrics.observe_query(name, time.perf_counter() - start, 0)
             return []
+
+    def stream_sql_columns(self, statement, name="other", batch_rows=5000):
+        # Yields the result of a SQLAlchemy statement batch_rows at a time, as {column: [values]}, so only one
+        # batch is held in memory however many rows the query returns; an empty result yields one empty batch
+        if self.query_backend is not None:
+            yield from self.query_backend.stream_columns(statement, name, batch_rows)
+            return
+        start, rows = time.perf_counter(), 0
+        try:
+            with self.engine.connect() as conn:
+                result = conn.execution_options(stream_results=True).execute(statement)
+                columns = list(result.keys())
+                getters = [itemgetter(index) for index in range(len(columns))]
+                while batch := result.fetchmany(batch_rows):
+                    rows += len(batch)
+                    yield {column: list(map(getter, batch)) for column, getter in zip(columns, getters)}
+                if not rows:
+                    yield {column: [] for column in columns}
+        finally:
+            metrics.observe_query(name, time.perf_counter() - start, rows)
+
+    def get_sql_columns(self, query, name="other", batch_rows=5000):
+        # Column-oriented result, {column: [values]}, filled from the cursor batch_rows at a time without
+        # building a dict per row; None if the query fails
+        if self.query_backend is not None:
+            return self.query_backend.get_columns(query, name)
+        start = time.perf_counter()
+        try:
+            with self.engine.connect() as conn:
+                with metrics.phase("sql_execute"):
+                    result = conn.execute(text(query))
+                with metrics.phase("sql_fetch_columns"):
+                    columns = list(result.keys())
+                    arrays = [[] for _ in columns]
+                    getters = [itemgetter(index) for index in range(len(columns))]
+                    while batch := result.fetchmany(batch_rows):
+                        for array, getter in zip(arrays, getters):
+                            array.extend(map(getter, batch))
+                rows = len(arrays[0]) if arrays else 0
+                metrics.observe_query(name, time.perf_counter() - start, rows)
+                return dict(zip(columns, arrays))
+
+        except Exception as e:
+            print(f"Error in get_sql_columns: {e}")
+            metrics.observe_query(name, time.perf_counter() - start, 0)
+            return None
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+# Months of the date dimension. The dimension is a generated calendar, one row per month from the first to
+# the last month of the data, gaps included, instead of the month strings of every fact row. Its key,
+# Date_ID, is the month as a sortable yyyymm integer (202503), so fact rows sort and filter by month
+# without a join; Month_Date is the month's label (March 2025).
+
+calendar_schema = {"Month_Date": "str", "Year": "int16", "Quarter": "int8", "Month": "int8", "Date_ID": "int32"}
+
+# Month_Date of the source csv, "Mar, 2025"
+source_month_format = "%b, %Y"
+
+def month_keys(months):
+    # yyyymm of a DatetimeIndex or PeriodIndex
+    return np.asarray(months.year * 100 + months.month, dtype=np.int32)
+
+def key_months(keys):
+    # PeriodIndex of yyyymm keys
+    keys = np.asarray(keys)
+    return pd.PeriodIndex.from_fields(year=keys // 100, month=keys % 100, freq="M")
+
+def month_range(first_key, last_key):
+    # yyyymm keys of the months from first_key to last_key, both included
+    first, last = key_months([first_key, last_key])
+    return month_keys(pd.period_range(first, last, freq="M"))
+
+def calendar(keys):
+    # Calendar rows of the given yyyymm keys
+    months = key_months(keys)
+    return pd.DataFrame({
+        "Month_Date": np.asarray(months.strftime("%B %Y"), dtype=object),
+        "Year": months.year,
+        "Quarter": months.quarter,
+        "Month": months.month,
+        "Date_ID": month_keys(months),
+    })
+
+class MonthLookup():
+    # yyyymm key of every source row, 0 for rows whose month is missing or does not parse. Only the distinct
+    # month strings are parsed, once each: a categorical column already holds them as its categories, other
+    # columns are factorized. Parsed strings are kept for the next chunk.
+
+    def __init__(self, format=source_month_format):
+        self.format = format
+        self.keys = {}
+
+    def __call__(self, months: pd.Series):
+        if isinstance(months.dtype, pd.CategoricalDtype):
+            codes, distinct = months.cat.codes.to_numpy(), months.cat.categories
+        else:
+            codes, distinct = pd.factorize(months)
+        missing = [month for month in distinct if month not in self.keys]
+        if missing:
+            parsed = pd.DatetimeIndex(pd.to_datetime(pd.Index(missing).astype(str), format=self.format, errors="coerce"))
+            self.keys.update(zip(missing, (parsed.year * 100 + parsed.month).fillna(0).astype(int).tolist()))
+        # The last entry is for missing values, whose code is -1
+        lookup = np.array([self.keys[month] for month in distinct] + [0], dtype=np.int32)
+        return lookup[codes]
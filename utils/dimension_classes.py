@@ -1,54 +1,182 @@
 from utils.datasetup import *
+from utils.transformations import change_type_series, KeyIndex
+from utils.staging import staging
+from utils.schema import apply_schema, change_type_dtype
+from utils.dates import calendar_schema, calendar, month_range
+import numpy as np
 import pandas as pd
 
 blob_name = "Cryptocurrency_Combined_Data_Tables.csv"
 database = AzureDB()
 database.access_container("csvfiles") # if fail use test-container
-df = database.access_blob_csv(blob_name=blob_name)
 
 class ModelAbstract():
-    
+    # Compact dtypes of the dimension's columns, see utils.schema
+    schema = {}
+
     def __init__(self):
         self.columns = None
         self.dimension_table = None
-        
-    def dimension_generator(self, name: str, columns: list):
-        dim = df[columns]
-        dim = dim.drop_duplicates()
-        
-        dim[f'{name}_id'] = range(1, len(dim) + 1)
-        
-        self.dimension_table = dim
+
+    @property
+    def dimension_table(self):
+        # The dimension is kept in blocks, the members added by each chunk, and only concatenated when the
+        # whole table is needed (load), so a chunk does not copy every member added before it
+        if len(self.blocks) > 1:
+            # Categoricals with different categories concatenate to strings, so the schema is applied again
+            self.blocks = [apply_schema(pd.concat(self.blocks), self.schema)]
+            self.offsets = [0]
+        return self.blocks[0] if self.blocks else None
+
+    @dimension_table.setter
+    def dimension_table(self, dimension_table):
+        self.blocks = [] if dimension_table is None else [dimension_table]
+        self.offsets = [] if dimension_table is None else [0]
+
+    def dimension_generator(self, name: str, columns: list, source: pd.DataFrame = None, id_column: str = None):
         self.name = name
         self.columns = columns
-    
+        self.id_column = id_column or f'{name}_id'
+        self.dimension_table = None
+        self.key_index = KeyIndex(columns)
+        self.loaded_rows = 0
+        self.last_id = 0
+
+        if source is not None:
+            self.update(source)
+
+    def seedable(self, dimension_table: pd.DataFrame):
+        # Whether an existing dimension has the columns this version generates
+        return set(self.schema).issubset(dimension_table.columns)
+
+    def seed(self, dimension_table: pd.DataFrame):
+        # Continue from a dimension already in the database; its members keep their ids and only
+        # members added after this are uploaded by load
+        self.dimension_table = apply_schema(dimension_table, self.schema)
+        self.key_index.seed(self.dimension_table)
+        self.loaded_rows = len(dimension_table)
+        self.last_id = int(dimension_table[self.id_column].max()) if len(dimension_table) else 0
+
+    def derive(self, dim: pd.DataFrame):
+        # Hook for subclasses to add computed attributes to newly generated members
+        return dim
+
+    def update(self, source: pd.DataFrame):
+        # Add the members of source that are not in the dimension yet, continuing the id sequence,
+        # and return the dimension row position of every source row
+        positions, dim = self.key_index.assign(source)
+
+        dim[self.id_column] = range(self.last_id + 1, self.last_id + len(dim) + 1)
+        self.last_id += len(dim)
+        dim = apply_schema(self.derive(dim), self.schema)
+
+        if not self.blocks or len(dim):
+            self.offsets.append(self.offsets[-1] + len(self.blocks[-1]) if self.blocks else 0)
+            self.blocks.append(dim)
+        return positions
+
+    def attributes(self, positions):
+        # Surrogate key and derived columns of the given dimension rows, for the fact table. Rows are taken
+        # from the block they are in; block_order groups the positions by block, in their original order.
+        block = np.searchsorted(self.offsets, positions, side="right") - 1
+        block_order = np.argsort(block, kind="stable")
+        bounds = np.searchsorted(block[block_order], np.arange(len(self.blocks) + 1))
+        pieces = [self.blocks[index].take(positions[block_order[first:last]] - self.offsets[index])
+                  for index, (first, last) in enumerate(zip(bounds[:-1], bounds[1:])) if last > first]
+        if len(pieces) != 1:
+            attributes = pd.concat(pieces or [self.blocks[-1].iloc[:0]])
+            attributes = attributes.iloc[np.argsort(block_order, kind="stable")]
+        else:
+            attributes = pieces[0]
+        return attributes.drop(columns=self.columns).reset_index(drop=True)
+
     def load(self):
-        
+
         if self.dimension_table is not None:
-            database.upload_dataframe_sqldatabase(f"{self.name}_dim", blob_data=self.dimension_table)
-            
-            self.dimension_table.to_csv(f"./data/{self.name}_dim.csv")
-            
+            if self.loaded_rows:
+                uploaded = self.append()
+            else:
+                uploaded = database.upload_dataframe_sqldatabase(f"{self.name}_dim", blob_data=self.dimension_table)
+
+            staging.write(f"{self.name}_dim", self.dimension_table)
+            return uploaded
+
         else:
             print("Please create a dimension table first using dimension_generator")
+            return False
+
+    def append(self):
+        new_members = self.dimension_table.iloc[self.loaded_rows:]
+        print(f"{len(new_members)} new members for {self.name}_dim")
+        if not len(new_members):
+            return True
+        try:
+            database.append_dataframe_sqldatabase(f"{self.name}_dim", blob_data=new_members)
+            self.loaded_rows = len(self.dimension_table)
+            return True
+        except Exception as e:
+            print(f"Error appending to table {self.name}_dim: {e}")
+            return False
 
 class DimDate(ModelAbstract):
-    def __init__(self):
+    # One row per month of a generated calendar (utils.dates); Date_ID is the yyyymm of the month, which the
+    # fact rows already carry, so there is no id sequence to continue
+    schema = calendar_schema
+
+    def __init__(self, source=None):
         super().__init__()
-        self.dimension_generator("Date", ["Month_Date"])
+        self.dimension_generator("Date", ["Date_ID"], source, id_column="Date_ID")
+
+    def update(self, source: pd.DataFrame):
+        # Add the months from the first to the last month of the dimension and source that it does not have
+        # yet, and return the dimension row position of every source row
+        keys = source["Date_ID"].to_numpy()
+        known = self.dimension_table["Date_ID"].to_numpy() if self.dimension_table is not None else keys[:0]
+        months = np.concatenate([known, keys])
+        new_months = month_range(months.min(), months.max()) if len(months) else months
+        dim = apply_schema(calendar(new_months[~np.isin(new_months, known)]), self.schema)
+
+        if self.dimension_table is None:
+            self.dimension_table = dim
+        elif len(dim):
+            # Kept in calendar order; with a watermark only later months are new, so the rows append() uploads
+            # stay after the loaded ones
+            self.dimension_table = pd.concat([self.dimension_table, dim]).sort_values("Date_ID", ignore_index=True)
+        return pd.Index(self.dimension_table["Date_ID"]).get_indexer(keys)
+
+    def attributes(self, positions):
+        # Only the key goes into the fact table
+        return self.dimension_table[[self.id_column]].take(positions).reset_index(drop=True)
 
 class DimPriceVariations(ModelAbstract):
-    def __init__(self):
+    schema = {"PriceVariations_id": "int32", "Price_Variation_Type": change_type_dtype, "Price_Variation_ID": "int32"}
+
+    def __init__(self, source=None):
         super().__init__()
-        self.dimension_generator("PriceVariations", ["High_Price", "Low_Price"])
-        
+        self.dimension_generator("PriceVariations", ["High_Price", "Low_Price"], source)
+
+    def derive(self, dim):
+        dim["Price_Variation"] = (dim["High_Price"] - dim["Low_Price"])
+        dim["Price_Variation_Type"] = change_type_series(dim["Price_Variation"])
+        dim["Price_Variation_ID"] = dim[self.id_column]
+        return dim
+
 class DimPriceDifferential(ModelAbstract):
-    def __init__(self):
+    schema = {"PriceDifferential_id": "int32", "Price_Differential_Type": change_type_dtype, "Price_Differential_ID": "int32"}
+
+    def __init__(self, source=None):
         super().__init__()
-        self.dimension_generator("PriceDifferential", ["Open_Price", "Close_Price"])
-        
+        self.dimension_generator("PriceDifferential", ["Open_Price", "Close_Price"], source)
+
+    def derive(self, dim):
+        dim["Price_Differential"] = (dim["Open_Price"] - dim["Close_Price"])
+        dim["Price_Differential_Type"] = change_type_series(dim["Price_Differential"])
+        dim["Price_Differential_ID"] = dim[self.id_column]
+        return dim
+
 class DimCrypto(ModelAbstract):
-    def __init__(self):
-        super().__init__()
-        self.dimension_generator("Crypto", ["ISO_Stdised_Key (PK)", "Crypto_Key (FK)", "Volume_Traded"])
+    schema = {"ISO_Stdised_Key (PK)": "category", "Crypto_Key (FK)": "int32", "Crypto_id": "int32"}
 
+    def __init__(self, source=None):
+        super().__init__()
+        self.dimension_generator("Crypto", ["ISO_Stdised_Key (PK)", "Crypto_Key (FK)", "Volume_Traded"], source)
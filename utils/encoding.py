@@ -0,0 +1,100 @@
+import io, json, struct
+from datetime import date, datetime
+from decimal import Decimal
+
+# Response encodings of the API's query results. Results are kept column-oriented, {column: [values]}, and
+# encoded once into the response body:
+#   "records" - a JSON list of row objects, what the dashboards read
+#   "columns" - the column-oriented result as JSON, smaller and faster to encode; pandas.DataFrame reads it as is
+#   "arrow"   - Arrow IPC streams, one per result, each preceded by its length as an 8 byte little-endian integer
+# orjson is used when it is installed, the standard json module otherwise.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+media_types = {
+    "records": "application/json",
+    "columns": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+def json_default(value):
+    # Types the SQL driver returns that JSON has no type for
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def json_bytes(data):
+    if orjson is not None:
+        return orjson.dumps(data, default=json_default)
+    return json.dumps(data, default=json_default, separators=(",", ":")).encode()
+
+def records(columns: dict):
+    names = list(columns)
+    return [dict(zip(names, row)) for row in zip(*columns.values())]
+
+def arrow_stream(columns: dict):
+    import pyarrow as pa
+    table = pa.table(columns)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+def encode(results: list, format="records"):
+    # Response body of a list of column-oriented results; a failed query (None) is encoded as an empty result
+    results = [columns or {} for columns in results]
+    if format == "columns":
+        return json_bytes(results)
+    if format == "arrow":
+        return b"".join(struct.pack("<Q", len(stream)) + stream for stream in map(arrow_stream, results))
+    return json_bytes([records(columns) for columns in results])
+
+def stream_page(batches, format="records", key=None, limit=None):
+    # Response body of one page, encoded batch by batch as the rows arrive. JSON pages are
+    # {"rows": [row objects], "next": key to pass as after for the next page, or null on the last page};
+    # Arrow pages are a single IPC stream, whose next page starts after its last key when it has limit rows.
+    if format == "arrow":
+        yield from stream_arrow_page(batches)
+        return
+    rows, last = 0, None
+    yield b'{"rows":['
+    for batch in batches:
+        count = len(next(iter(batch.values()), []))
+        if not count:
+            continue
+        yield (b"," if rows else b"") + json_bytes(records(batch))[1:-1]
+        rows += count
+        last = batch[key][-1] if key else None
+    yield b'],"next":' + json_bytes(last if limit and rows >= limit else None) + b"}"
+
+def stream_arrow_page(batches):
+    import pyarrow as pa
+    sink, writer, schema = io.BytesIO(), None, None
+    for batch in batches:
+        record_batch = pa.record_batch(batch, schema=schema)
+        if writer is None:
+            schema = record_batch.schema
+            writer = pa.ipc.new_stream(sink, schema)
+        if record_batch.num_rows:
+            writer.write_batch(record_batch)
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    if writer is not None:
+        writer.close()
+        yield sink.getvalue()
+
+def read_arrow(body: bytes):
+    # The pyarrow Tables of an "arrow" response body
+    import pyarrow as pa
+    tables, offset = [], 0
+    while offset < len(body):
+        (length,) = struct.unpack_from("<Q", body, offset)
+        offset += 8
+        tables.append(pa.ipc.open_stream(body[offset:offset + length]).read_all())
+        offset += length
+    return tables
@@ -0,0 +1,75 @@
+import os, hashlib
+import pandas as pd
+
+def blob_version(properties):
+    # What identifies one version of a blob: its ETag, last modified time and content MD5 (when the service has one)
+    content_settings = getattr(properties, "content_settings", None)
+    content_md5 = getattr(content_settings, "content_md5", None)
+    return "|".join([
+        str(getattr(properties, "etag", "")),
+        str(getattr(properties, "last_modified", "")),
+        bytes(content_md5).hex() if content_md5 else "",
+    ])
+
+class ExtractCache():
+    # Parsed source blobs kept as Parquet files under path, keyed by blob name and version, so an unchanged
+    # blob is read from disk instead of being downloaded and parsed again. A new version of a blob gets a new
+    # key; beyond max_bytes the least recently used files are removed.
+
+    def __init__(self, path, max_bytes=1024 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def file_path(self, blob_name, properties):
+        key = hashlib.sha256(f"{blob_name}|{blob_version(properties)}".encode()).hexdigest()
+        return os.path.join(self.path, f"{key}.parquet")
+
+    def get(self, blob_name, properties):
+        if not self.max_bytes or properties is None:
+            return None
+        file_path = self.file_path(blob_name, properties)
+        try:
+            data = pd.read_parquet(file_path)
+        except Exception:
+            return None
+        os.utime(file_path)
+        print(f"Blob {blob_name} unchanged, read from the extract cache")
+        return data
+
+    def put(self, blob_name, properties, data: pd.DataFrame):
+        if not self.max_bytes or properties is None or data is None:
+            return
+        file_path = self.file_path(blob_name, properties)
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            # Written under a temporary name first so a reader never sees a partial file
+            data.to_parquet(file_path + ".tmp", index=False)
+            os.replace(file_path + ".tmp", file_path)
+        except Exception as e:
+            print(f"Could not cache blob {blob_name}: {e}")
+            return
+        self.evict()
+
+    def evict(self):
+        files = []
+        for name in os.listdir(self.path):
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            if name.endswith(".parquet"):
+                files.append((stat.st_mtime, stat.st_size, name))
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, name in sorted(files):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            size -= file_size
+
+    def clear(self):
+        if os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                os.remove(os.path.join(self.path, name))
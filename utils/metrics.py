@@ -0,0 +1,142 @@
+import os, time, threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Bucket upper bounds of the histograms: seconds for latencies, counts for rows, bytes for payloads
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+row_buckets = (1, 10, 100, 1000, 10000, 100000, 1000000)
+size_buckets = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+def format_labels(names, values, extra=""):
+    labels = [f'{name}="{value}"' for name, value in zip(names, values)] + ([extra] if extra else [])
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+class Histogram():
+    # Cumulative buckets, sum and count per combination of label values, in the Prometheus histogram layout
+    def __init__(self, name, description, labels=(), buckets=latency_buckets):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                # One count per bucket plus +Inf, then the sum
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {labels: list(values) for labels, values in self.series.items()}
+        for label_values, values in sorted(series.items()):
+            count = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), values):
+                count += bucket
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, label_values, le)} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, label_values)} {values[-1]}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, label_values)} {count}")
+        return lines
+
+class Gauge():
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def add(self, amount, *label_values):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge"]
+        with self.lock:
+            series = dict(self.series)
+        lines += [f"{self.name}{format_labels(self.labels, label_values)} {value}" for label_values, value in sorted(series.items())]
+        return lines
+
+class Metrics():
+    # Request and query metrics of the API, served as Prometheus text at /metrics. Recording is a lock and a
+    # bisect per observation, cheap enough to leave on; API_METRICS=false turns it off.
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.request_seconds = Histogram("api_request_duration_seconds", "Latency of API requests by route",
+                                         ("method", "route", "status"))
+        self.response_bytes = Histogram("api_response_size_bytes", "Size of API response bodies by route",
+                                        ("route",), size_buckets)
+        self.in_flight = Gauge("api_requests_in_flight", "Requests being served", ("method",))
+        self.phase_seconds = Histogram("api_phase_duration_seconds",
+                                       "Time spent in each step of a request: argon2_verify, jwt_decode, "
+                                       "sql_execute, sql_rows_to_dict, sql_fetch_columns, json_encode, arrow_encode", ("phase",))
+        self.query_seconds = Histogram("api_sql_query_duration_seconds", "Execution and fetch time of each SQL query",
+                                       ("query",))
+        self.query_rows = Histogram("api_sql_query_rows", "Rows returned by each SQL query", ("query",), row_buckets)
+        self.collectors = [self.request_seconds, self.response_bytes, self.in_flight, self.phase_seconds,
+                           self.query_seconds, self.query_rows]
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.enabled:
+                self.phase_seconds.observe(time.perf_counter() - start, name)
+
+    def observe_query(self, query, seconds, rows):
+        if self.enabled:
+            self.query_seconds.observe(seconds, query)
+            self.query_rows.observe(rows, query)
+
+    def render(self):
+        lines = []
+        for collector in self.collectors:
+            lines += collector.render()
+        return "\n".join(lines) + "\n"
+
+class MetricsMiddleware():
+    # ASGI middleware timing every HTTP request. Requests are labelled by the route template (e.g.
+    # "/data/manager") rather than the raw path, so unknown paths do not create new series.
+
+    def __init__(self, app, metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.metrics.enabled:
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        response = {"status": 500, "bytes": 0}
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        self.metrics.in_flight.add(1, method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.metrics.in_flight.add(-1, method)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.metrics.request_seconds.observe(elapsed, method, route, str(response["status"]))
+            self.metrics.response_bytes.observe(response["bytes"], route)
+
+metrics = Metrics(enabled=os.environ.get("API_METRICS", "true").lower() in ("1", "true", "yes"))
@@ -0,0 +1,84 @@
+import os, time, threading
+from sqlalchemy.pool import QueuePool
+
+def pool_setting(role, name, default):
+    # API_SQL_POOL_SIZE overrides SQL_POOL_SIZE for the API pool, ETL_SQL_POOL_SIZE for the ETL pool
+    return os.environ.get(f"{role.upper()}_SQL_{name}", os.environ.get(f"SQL_{name}", default))
+
+def pool_settings(role="etl"):
+    # The API pool matches the threads its queries run on (API_SQL_WORKERS), the ETL pool the dimension
+    # upload workers (ETL_LOAD_WORKERS) plus the connection MainETL.load holds for the fact table
+    if role == "api":
+        pool_size, max_overflow = int(os.environ.get("API_SQL_WORKERS", 8)), 2
+    else:
+        pool_size, max_overflow = int(os.environ.get("ETL_LOAD_WORKERS", 4)) + 1, 5
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": int(pool_setting(role, "POOL_SIZE", pool_size)),
+        "max_overflow": int(pool_setting(role, "MAX_OVERFLOW", max_overflow)),
+        # Azure SQL closes idle connections, so check them before use and replace them well before its timeout
+        "pool_pre_ping": str(pool_setting(role, "POOL_PRE_PING", "1")).lower() in ("1", "true", "yes"),
+        "pool_recycle": int(pool_setting(role, "POOL_RECYCLE", 1800)),
+        "pool_timeout": float(pool_setting(role, "POOL_TIMEOUT", 30)),
+    }
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that counts checkouts and new connections and measures how long callers wait for a connection
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait = time.perf_counter() - start
+            with self.stats_lock:
+                self.checkouts += 1
+                self.wait_time += wait
+                self.max_wait = max(self.max_wait, wait)
+
+    def _create_connection(self):
+        with self.stats_lock:
+            self.connects += 1
+        return super()._create_connection()
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "pool_size": self.size(),
+                "checked_out": self.checkedout(),
+                "idle": self.checkedin(),
+                "overflow": self.overflow(),
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "avg_wait_ms": round(self.wait_time / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+            }
+
+def pool_stats(engine):
+    pool = engine.pool
+    if isinstance(pool, TimedQueuePool):
+        return pool.stats()
+    return {"status": pool.status()}
+
+def warm_pool(engine, connections=None):
+    # Open the pool's connections up front so the first requests do not pay the TLS/ODBC handshake
+    if connections is None:
+        connections = engine.pool.size() if isinstance(engine.pool, QueuePool) else 0
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(engine.connect())
+    except Exception as e:
+        print(f"Could not warm the connection pool: {e}")
+    finally:
+        for connection in opened:
+            connection.close()
+    return len(opened)
@@ -0,0 +1,151 @@
+import os, io, json, time, resource, threading, tracemalloc, cProfile, pstats
+from contextlib import contextmanager
+
+class StageRecord():
+    # Totals of one named stage; a stage that runs several times (e.g. once per chunk) adds up
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.peak_rss = 0
+        self.peak_traced = 0
+
+    def as_dict(self):
+        return {
+            "stage": self.name,
+            "calls": self.calls,
+            "wall_s": round(self.wall, 6),
+            "cpu_s": round(self.cpu, 6),
+            "peak_rss_mb": round(self.peak_rss / 1024 / 1024, 1),
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "rows_per_s": round(self.rows / self.wall, 1) if self.wall and self.rows else 0.0,
+            **({"peak_traced_mb": round(self.peak_traced / 1024 / 1024, 1)} if self.peak_traced else {}),
+        }
+
+class Measurement():
+    # Handed to the body of a stage, which fills in the rows and bytes it processed
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+
+def peak_rss():
+    # High-water mark of the process' resident memory, in bytes (ru_maxrss is in KiB on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class StageProfiler():
+    # Wall time, CPU time, peak RSS, rows and bytes per ETL stage. Stages nest: a stage started inside another
+    # is recorded as "outer/inner". CPU time is the whole process', so it includes concurrent threads.
+    # capture="tracemalloc" also records the peak Python allocation of every stage, capture="cprofile"
+    # profiles the functions called during a run (see run).
+
+    def __init__(self, capture=None):
+        self.capture = capture
+        self.records = {}
+        self.order = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def reset(self):
+        with self.lock:
+            self.records, self.order = {}, []
+
+    @contextmanager
+    def stage(self, name):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        path = "/".join([frame[0] for frame in stack] + [name])
+        measurement = Measurement()
+        tracing = self.capture == "tracemalloc" and tracemalloc.is_tracing()
+        if tracing:
+            # The enclosing stage keeps the peak reached so far, the new one starts from the current usage
+            if stack:
+                stack[-1][1][0] = max(stack[-1][1][0], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        traced = [0]
+        stack.append((name, traced))
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield measurement
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            stack.pop()
+            if tracing:
+                traced[0] = max(traced[0], tracemalloc.get_traced_memory()[1])
+                if stack:
+                    stack[-1][1][0] = max(stack[-1][1][0], traced[0])
+            with self.lock:
+                record = self.records.get(path)
+                if record is None:
+                    record = self.records[path] = StageRecord(path)
+                    self.order.append(path)
+                record.calls += 1
+                record.wall += wall
+                record.cpu += cpu
+                record.rows += measurement.rows
+                record.bytes += measurement.bytes
+                record.peak_rss = max(record.peak_rss, peak_rss())
+                record.peak_traced = max(record.peak_traced, traced[0])
+
+    def run(self, func, pstats_path=None):
+        # Run func under the capture mode; with cprofile the stats are written to pstats_path and the
+        # slowest functions printed
+        if self.capture == "tracemalloc":
+            tracemalloc.start()
+        profile = cProfile.Profile() if self.capture == "cprofile" else None
+        try:
+            if profile:
+                return profile.runcall(func)
+            return func()
+        finally:
+            if self.capture == "tracemalloc":
+                tracemalloc.stop()
+            if profile:
+                if pstats_path:
+                    profile.dump_stats(pstats_path)
+                    print(f"cProfile stats written to {pstats_path}")
+                out = io.StringIO()
+                pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(20)
+                print(out.getvalue())
+
+    def stats(self):
+        with self.lock:
+            return [self.records[path].as_dict() for path in self.order]
+
+    def to_json(self):
+        return json.dumps({"stages": self.stats()}, indent=2)
+
+    def to_prometheus(self, prefix="etl_stage"):
+        metrics = [
+            ("wall_seconds", "wall_s", "Wall time spent in the stage"),
+            ("cpu_seconds", "cpu_s", "Process CPU time spent in the stage"),
+            ("peak_rss_megabytes", "peak_rss_mb", "Process peak resident memory at the end of the stage"),
+            ("rows", "rows", "Rows processed by the stage"),
+            ("bytes", "bytes", "Bytes processed by the stage"),
+            ("rows_per_second", "rows_per_s", "Rows processed per second of wall time"),
+            ("calls", "calls", "Times the stage ran"),
+        ]
+        stats = self.stats()
+        lines = []
+        for metric, key, description in metrics:
+            lines += [f"# HELP {prefix}_{metric} {description}", f"# TYPE {prefix}_{metric} gauge"]
+            lines += [f'{prefix}_{metric}{{stage="{stage["stage"]}"}} {stage[key]}' for stage in stats]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # Prometheus text for a .prom file, JSON otherwise
+        with open(path, "w") as output:
+            output.write(self.to_prometheus() if path.endswith(".prom") else self.to_json())
+        print(f"ETL profile written to {path}")
+
+    def report(self):
+        print(f"{'stage':<44} {'calls':>5} {'wall s':>8} {'cpu s':>8} {'rss MB':>8} {'rows':>10} {'rows/s':>11}")
+        for stage in self.stats():
+            print(f"{stage['stage']:<44} {stage['calls']:>5} {stage['wall_s']:>8.2f} {stage['cpu_s']:>8.2f} "
+                  f"{stage['peak_rss_mb']:>8.1f} {stage['rows']:>10} {stage['rows_per_s']:>11.0f}")
+
+profiler = StageProfiler(capture=(os.environ.get("ETL_PROFILE_CAPTURE") or "").lower() or None)
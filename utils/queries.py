@@ -0,0 +1,37 @@
+# Filtered queries of the star schema behind the /query endpoints. Statements are built with SQLAlchemy Core,
+# so every filter value is a bound parameter and the row limit is compiled for the engine's dialect (TOP on
+# SQL Server). Pages are keyset paginated on Crypto_Fact_ID: a page starts after the last key of the previous
+# one, which the clustered primary key serves without counting the skipped rows.
+from sqlalchemy import select, table, column
+
+fact = table("Crypto_Fact", column("Crypto_Fact_ID"), column("Crypto_id"), column("Date_ID"), column("Change_pct"),
+             column("Price_Variation"), column("Price_Variation_Type"), column("Price_Differential"),
+             column("Price_Differential_Type"), schema="dbo")
+crypto_dim = table("Crypto_dim", column("Crypto_id"), column("ISO_Stdised_Key (PK)"), column("Volume_Traded"), schema="dbo")
+date_dim = table("Date_dim", column("Date_ID"), column("Month_Date"), schema="dbo")
+
+def month_key(month):
+    # The yyyymm Date_ID of a "YYYY-MM" query parameter
+    return int(month.replace("-", ""))
+
+def price_page_query(symbols=None, start=None, end=None, after=None, limit=1000):
+    # Crypto_Fact rows with their symbol and month, at most limit of them after the key after. start and end
+    # are yyyymm Date_IDs, both included; Date_ID is the month itself, so the range needs no Date_dim lookup.
+    statement = (
+        select(fact.c.Crypto_Fact_ID, crypto_dim.c["ISO_Stdised_Key (PK)"].label("Crypto"), date_dim.c.Month_Date,
+               crypto_dim.c.Volume_Traded, fact.c.Change_pct, fact.c.Price_Variation, fact.c.Price_Variation_Type,
+               fact.c.Price_Differential, fact.c.Price_Differential_Type)
+        .select_from(fact.join(crypto_dim, fact.c.Crypto_id == crypto_dim.c.Crypto_id)
+                         .join(date_dim, fact.c.Date_ID == date_dim.c.Date_ID))
+        .order_by(fact.c.Crypto_Fact_ID)
+        .limit(limit)
+    )
+    if symbols:
+        statement = statement.where(crypto_dim.c["ISO_Stdised_Key (PK)"].in_(symbols))
+    if start is not None:
+        statement = statement.where(fact.c.Date_ID >= start)
+    if end is not None:
+        statement = statement.where(fact.c.Date_ID <= end)
+    if after is not None:
+        statement = statement.where(fact.c.Crypto_Fact_ID > after)
+    return statement
@@ -0,0 +1,43 @@
+import os
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Compact dtypes for the ETL's DataFrames: repeated strings become categoricals, surrogate ids the smallest
+# integer that holds them and the price change types a fixed enum. Prices, volumes and percentages stay
+# float64, float32 keeps only about 7 significant digits and would change the loaded values.
+# ETL_COMPACT_DTYPES=false keeps the default pandas dtypes.
+compact_dtypes = os.environ.get("ETL_COMPACT_DTYPES", "true").lower() in ("1", "true", "yes")
+
+change_type_dtype = pd.CategoricalDtype(["UNCHANGED", "DOWN", "UP"])
+
+# Columns of the source csv, applied as soon as it is extracted
+source_schema = {
+    "ISO_Stdised_Key (PK)": "category",
+    "Crypto_Key (FK)": "int32",
+    "Month_Date": "category",
+}
+
+# Columns of Crypto_Fact; the dimension tables declare theirs in utils.dimension_classes
+fact_schema = {
+    "Crypto_id": "int32",
+    "Date_ID": "int32",
+    "PriceVariations_id": "int32",
+    "Price_Variation_Type": change_type_dtype,
+    "Price_Variation_ID": "int32",
+    "PriceDifferential_id": "int32",
+    "Price_Differential_Type": change_type_dtype,
+    "Price_Differential_ID": "int32",
+}
+
+def apply_schema(data: pd.DataFrame, schema: dict):
+    # Cast the columns of data that the schema declares; columns it does not have are skipped
+    if not compact_dtypes or data is None:
+        return data
+    dtypes = {column: dtype for column, dtype in schema.items() if column in data.columns and data[column].dtype != dtype}
+    return data.astype(dtypes) if dtypes else data
+
+def memory_per_row(data: pd.DataFrame):
+    # Bytes per row, counting the contents of string columns
+    return data.memory_usage(index=True, deep=True).sum() / max(len(data), 1)
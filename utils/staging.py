@@ -0,0 +1,84 @@
+import os, shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class StagingArea():
+    # Local copies of the loaded tables under local_path, as CSV (the original side outputs) or Parquet.
+    # Parquet tables keep their key columns dictionary encoded and the fact table is partitioned by
+    # Month_Date, so readers can load only the columns and months they need. The ETL touches complete_path
+    # after a load succeeded; staged tables newer than it are from a load still running or one that failed.
+
+    def __init__(self, local_path="./data", staging_format="csv"):
+        self.local_path = local_path
+        self.staging_format = staging_format
+        self.complete_path = os.path.join(local_path, "staging.complete")
+
+    def mark_complete(self):
+        try:
+            os.makedirs(self.local_path, exist_ok=True)
+            with open(self.complete_path, "a"):
+                os.utime(self.complete_path)
+        except OSError as e:
+            print(f"Could not touch staging marker {self.complete_path}: {e}")
+
+    def completed(self):
+        # Modification time of the last completed load's marker, None before the first one
+        try:
+            return os.stat(self.complete_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def path(self, name):
+        if self.staging_format == "parquet":
+            return os.path.join(self.local_path, f"{name}.parquet")
+        return os.path.join(self.local_path, f"{name}.csv")
+
+    def write(self, name, data: pd.DataFrame, partitions: pd.Series = None, append=False):
+        # partitions holds the partition value of every row (e.g. the fact rows' Month_Date); CSV ignores it
+        if self.staging_format != "parquet":
+            data.to_csv(self.path(name), mode="a" if append else "w", header=not append)
+            return
+
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        keys = [column for column in data.columns if column.endswith(("_id", "_ID", "_Type"))]
+        if partitions is None:
+            pq.write_table(table, self.path(name), use_dictionary=keys)
+            return
+
+        partition_by = partitions.name
+        table = table.append_column(partition_by, pa.array(partitions.to_numpy()))
+        if not append and os.path.exists(self.path(name)):
+            shutil.rmtree(self.path(name))
+        # Every write adds its own files to the month partitions, so appended chunks never overwrite each other
+        part = sum(len(files) for _, _, files in os.walk(self.path(name))) if append else 0
+        pq.write_to_dataset(table, self.path(name), partition_cols=[partition_by], use_dictionary=keys,
+                            basename_template=f"part-{part}-{{i}}.parquet", existing_data_behavior="overwrite_or_ignore")
+
+    def read(self, name, columns=None, partitions=None, partition_by="Month_Date"):
+        # Load a staged table; for Parquet only the given columns and partition values are read
+        if self.staging_format != "parquet":
+            data = pd.read_csv(self.path(name), index_col=0)
+            if partitions is not None:
+                data = data[self.partition_values(name, data, partition_by).isin(partitions)]
+            if columns is not None:
+                data = data[list(columns)]
+            return data
+
+        filters = None if partitions is None else [(partition_by, "in", list(partitions))]
+        return pq.read_table(self.path(name), columns=columns, filters=filters).to_pandas()
+
+    def partition_values(self, name, data, partition_by):
+        # Partition value of every row of a CSV table. The fact rows hold Date_ID instead of Month_Date, so
+        # their months are looked up through the staged date dimension, as when the Parquet copy is written
+        if partition_by in data.columns:
+            return data[partition_by]
+        if partition_by == "Month_Date" and "Date_ID" in data.columns:
+            months = pd.read_csv(self.path("Date_dim"), index_col=0).set_index("Date_ID")["Month_Date"]
+            return data["Date_ID"].map(months)
+        raise ValueError(f"{name} cannot be read by {partition_by}")
+
+staging = StagingArea(staging_format=os.environ.get("ETL_STAGING_FORMAT", "csv").lower())
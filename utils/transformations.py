@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+from utils.schema import compact_dtypes, change_type_dtype
+
+volume_multipliers = {"B": 1e9, "M": 1e6}
+
+# Row-by-row reference implementations, kept to check the vectorized versions against
+
+def convert_volume(x):
+    x = str(x).replace(",", "")
+    if x.endswith('B'):
+        return float(x[:-1]) * 1e9
+    elif x.endswith('M'):
+        return float(x[:-1]) * 1e6
+    else:
+        return float(x)
+
+def change_type(x):
+    return "DOWN" if x > 0 else "UP" if x < 0 else "UNCHANGED"
+
+# Vectorized implementations used by MainETL
+
+def convert_volume_series(volume: pd.Series):
+    # "9.27B" -> 9.27 * 1e9, "512.3M" -> 512.3 * 1e6, "1,234" -> 1234.0
+    volume = volume.astype(str).str.replace(",", "", regex=False)
+    suffixes = [volume.str.endswith(suffix).to_numpy(dtype=bool) for suffix in volume_multipliers]
+    has_suffix = np.logical_or.reduce(suffixes)
+    multiplier = np.select(suffixes, list(volume_multipliers.values()), default=1.0)
+
+    # astype(float) parses with the same correctly rounded conversion as float(), so results match convert_volume exactly
+    number = volume.where(~has_suffix, volume.str[:-1]).astype(float).to_numpy(copy=True)
+    number[has_suffix] *= multiplier[has_suffix]
+    return pd.Series(number, index=volume.index, name=volume.name)
+
+change_types = np.array(change_type_dtype.categories, dtype=object)
+
+def change_type_series(change: pd.Series):
+    # Positive -> DOWN, negative -> UP, zero or missing -> UNCHANGED; the codes index change_type_dtype,
+    # so the compact schema gets its enum without comparing any strings
+    values = change.to_numpy()
+    codes = np.select([values > 0, values < 0], [1, 2], default=0)
+    if compact_dtypes:
+        return pd.Series(pd.Categorical.from_codes(codes, dtype=change_type_dtype), index=change.index, name=change.name)
+    return pd.Series(change_types[codes], index=change.index, name=change.name)
+
+class KeyIndex():
+    # Hash index from a dimension's natural key columns to its row positions. The keys are indexed in
+    # blocks, oldest first, and a block is merged into the one before it once it is as large, so a batch
+    # is looked up in a few blocks and the index is not copied every time members are added.
+
+    def __init__(self, columns: list):
+        self.columns = columns
+        self.size = 0
+        self.members = None
+        self.blocks = []
+        self.starts = []
+
+    def __len__(self):
+        return self.size
+
+    def seed(self, members: pd.DataFrame):
+        # Start from the keys of an existing dimension, in row-position order
+        self.members = members[self.columns]
+        self.blocks, self.starts = [], []
+        self.size = len(members)
+
+    def lookup(self, members: pd.MultiIndex):
+        # Row positions of the given keys, -1 for those not indexed
+        positions = np.full(len(members), -1)
+        for block, start in zip(reversed(self.blocks), reversed(self.starts)):
+            missing = np.flatnonzero(positions == -1)
+            if not len(missing):
+                break
+            found = block.get_indexer(members[missing])
+            positions[missing[found >= 0]] = found[found >= 0] + start
+        return positions
+
+    def add(self, members: pd.MultiIndex, start: int):
+        self.blocks.append(members)
+        self.starts.append(start)
+        while len(self.blocks) > 1 and len(self.blocks[-1]) >= len(self.blocks[-2]):
+            last = self.blocks.pop()
+            self.starts.pop()
+            self.blocks[-1] = self.blocks[-1].append(last)
+
+    def assign(self, source: pd.DataFrame):
+        # Factorize the natural keys of source in one pass and return the dimension row position of
+        # every source row, plus the distinct keys not indexed yet (first appearances, in order)
+        keys = source[self.columns]
+        # observed=True: only the categories present get a group number (pandas 2 defaults to all of them)
+        codes = keys.groupby(self.columns, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+        members = keys.iloc[np.unique(codes, return_index=True)[1]]
+
+        if self.size == 0:
+            # Nothing to look up against; the hash index is only built once a second batch arrives
+            positions = np.arange(len(members))
+            self.members = members
+        else:
+            if self.members is not None:
+                self.add(pd.MultiIndex.from_frame(self.members), 0)
+                self.members = None
+            positions = self.lookup(pd.MultiIndex.from_frame(members))
+            is_new = positions == -1
+            members = members[is_new]
+            positions[is_new] = np.arange(self.size, self.size + len(members))
+            self.add(pd.MultiIndex.from_frame(members), self.size)
+
+        self.size += len(members)
+        return positions[codes], members.copy()
@@ -0,0 +1,138 @@
+# Final definitions of the star schema tables, used by the schema-first load (ETL_SCHEMA_FIRST). Every table
+# is loaded into a staging copy that already has its final column types and clustered primary key; the
+# surrogate keys arrive in ascending order, so rows are appended to the index instead of rebuilding it after
+# the load. Once every table is loaded, the staging copies are renamed in place of the live tables in one
+# transaction and the foreign keys are added without checking the existing rows.
+
+from utils.aggregates import summary_tables
+
+table_definitions = {
+    "Crypto_dim": {
+        "columns": {
+            "ISO_Stdised_Key (PK)": "NVARCHAR(64)",
+            "Crypto_Key (FK)": "BIGINT",
+            "Volume_Traded": "FLOAT",
+            "Crypto_id": "BIGINT NOT NULL",
+        },
+        "primary_key": "Crypto_id",
+    },
+    "Date_dim": {
+        "columns": {
+            "Month_Date": "NVARCHAR(32)",
+            "Year": "SMALLINT",
+            "Quarter": "TINYINT",
+            "Month": "TINYINT",
+            "Date_ID": "BIGINT NOT NULL",
+        },
+        "primary_key": "Date_ID",
+    },
+    "PriceVariations_dim": {
+        "columns": {
+            "High_Price": "FLOAT",
+            "Low_Price": "FLOAT",
+            "PriceVariations_id": "BIGINT NOT NULL",
+            "Price_Variation": "FLOAT",
+            "Price_Variation_Type": "NVARCHAR(16)",
+            "Price_Variation_ID": "BIGINT",
+        },
+        "primary_key": "PriceVariations_id",
+    },
+    "PriceDifferential_dim": {
+        "columns": {
+            "Open_Price": "FLOAT",
+            "Close_Price": "FLOAT",
+            "PriceDifferential_id": "BIGINT NOT NULL",
+            "Price_Differential": "FLOAT",
+            "Price_Differential_Type": "NVARCHAR(16)",
+            "Price_Differential_ID": "BIGINT",
+        },
+        "primary_key": "PriceDifferential_id",
+    },
+    "Crypto_Fact": {
+        "columns": {
+            "Change_pct": "FLOAT",
+            "Crypto_id": "BIGINT",
+            "Date_ID": "BIGINT",
+            "PriceVariations_id": "BIGINT",
+            "Price_Variation": "FLOAT",
+            "Price_Variation_Type": "NVARCHAR(16)",
+            "Price_Variation_ID": "BIGINT",
+            "PriceDifferential_id": "BIGINT",
+            "Price_Differential": "FLOAT",
+            "Price_Differential_Type": "NVARCHAR(16)",
+            "Price_Differential_ID": "BIGINT",
+            "Crypto_Fact_ID": "BIGINT NOT NULL",
+        },
+        "primary_key": "Crypto_Fact_ID",
+        # Referenced table -> referencing column
+        "foreign_keys": {
+            "Crypto_dim": "Crypto_id",
+            "Date_dim": "Date_ID",
+            "PriceVariations_dim": "PriceVariations_id",
+            "PriceDifferential_dim": "PriceDifferential_id",
+        },
+    },
+}
+
+def staging_name(name):
+    return f"{name}_staging"
+
+def create_staging_statements(name):
+    # An empty staging copy of the table with its final types and clustered primary key
+    definition = table_definitions[name]
+    columns = ",\n    ".join(f"[{column}] {sql_type}" for column, sql_type in definition["columns"].items())
+    staging = staging_name(name)
+    return [
+        f"DROP TABLE IF EXISTS [dbo].[{staging}];",
+        f"CREATE TABLE [dbo].[{staging}] (\n    {columns},\n"
+        f"    CONSTRAINT [PK_{staging}] PRIMARY KEY CLUSTERED ([{definition['primary_key']}] ASC)\n);",
+    ]
+
+def swap_statements(names):
+    # Replace the live tables with their staging copies; tables with foreign keys are dropped first, so the
+    # tables they reference can be dropped too
+    names = sorted(names, key=lambda name: "foreign_keys" not in table_definitions[name])
+    statements = [f"DROP TABLE IF EXISTS [dbo].[{name}];" for name in names]
+    for name in names:
+        staging = staging_name(name)
+        statements += [
+            f"EXEC sp_rename 'dbo.{staging}', '{name}';",
+            f"EXEC sp_rename 'dbo.PK_{staging}', 'PK_{name}', 'OBJECT';",
+        ]
+    for name in names:
+        for referenced, column in table_definitions[name].get("foreign_keys", {}).items():
+            statements.append(
+                f"IF OBJECT_ID(N'dbo.{referenced}', N'U') IS NOT NULL "
+                f"ALTER TABLE [dbo].[{name}] WITH NOCHECK ADD CONSTRAINT [FK_{referenced}] FOREIGN KEY ([{column}]) "
+                f"REFERENCES [dbo].[{referenced}] ([{column}]) ON UPDATE CASCADE ON DELETE CASCADE;")
+    return statements
+
+def fact_indexes():
+    # One nonclustered index per Crypto_Fact column the dashboard queries join on, including every other fact
+    # column those queries read, so each query is answered from an index instead of scanning the fact table
+    indexes = {}
+    for summary in summary_tables.values():
+        used = summary["fact_joins"] + summary["fact_columns"]
+        for column in summary["fact_joins"]:
+            include = indexes.setdefault(column, [])
+            include += [other for other in used if other != column and other not in include]
+    return indexes
+
+def index_statements(mode="rowstore", name="Crypto_Fact"):
+    # Indexes of the fact table that are missing: "rowstore" creates the covering indexes of fact_indexes,
+    # "columnstore" one nonclustered columnstore index over every column the queries use, "none" nothing
+    indexes = fact_indexes()
+    if mode == "columnstore":
+        columns = list(dict.fromkeys(column for key, include in indexes.items() for column in [key] + include))
+        definitions = {f"NCCI_{name}": f"NONCLUSTERED COLUMNSTORE INDEX [NCCI_{name}] ON [dbo].[{name}] "
+                                       f"({', '.join(f'[{column}]' for column in columns)})"}
+    elif mode == "rowstore":
+        definitions = {}
+        for key, include in indexes.items():
+            index = f"IX_{name}_{key}"
+            included = f" INCLUDE ({', '.join(f'[{column}]' for column in include)})" if include else ""
+            definitions[index] = f"NONCLUSTERED INDEX [{index}] ON [dbo].[{name}] ([{key}]){included}"
+    else:
+        return []
+    return [f"IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'{index}' AND object_id = OBJECT_ID(N'dbo.{name}')) "
+            f"CREATE {definition};" for index, definition in definitions.items()]
@@ -88,7 +88,8 @@ def fetch_data():
     # Fetch data from API
     try:
         headers = {'Authorization': f'Bearer {st.session_state.jwt_token}'}
-        response = requests.get(f"{API_URL}{data_url}", headers=headers, timeout=10)
+        # Column-oriented results ({column: [values]}), which pandas.DataFrame reads directly
+        response = requests.get(f"{API_URL}{data_url}", params={'format': 'columns'}, headers=headers, timeout=10)
         
         if response.status_code == 200:
             try:
@@ -181,15 +182,9 @@ def display_employee_data(data):
             st.write("Raw API data:", data)
             return
 
-        # # Define the month order
-        # month_order = {
-        #     'January': 1, 'February': 2, 'March': 3, 'April': 4,
-        #     'May': 5, 'June': 6, 'July': 7, 'August': 8,
-        #     'September': 9, 'October': 10, 'November': 11, 'December': 12
-        # }
-
-        # monthly_df['month_num'] = monthly_df['Month_Date'].map(month_order)
-        # monthly_df = monthly_df.sort_values('month_num')
+        # Months sort by their Date_ID, the yyyymm of the month
+        if 'Date_ID' in volume_df.columns:
+            volume_df = volume_df.sort_values(['Crypto', 'Date_ID'])
 
         # Create two columns for visualizations
         col1, col2 = st.columns([7, 5])
@@ -72,7 +72,7 @@ async function displayData(token) {
 
         try {
             if (dataUrl=="/data/manager") {
-                const data = JSON.parse(datain)[0]
+                const data = datain[0]
             new Chart(
                 document.getElementById('separate-pay'),
                 {
@@ -107,7 +107,7 @@ async function displayData(token) {
                   }
                 }
               );
-              const total = JSON.parse(datain)[1]
+              const total = datain[1]
               new Chart(
                 document.getElementById('total-pay'),
                 {
@@ -130,7 +130,7 @@ async function displayData(token) {
                 }
               );
         } else if (dataUrl=="/data/employee") {
-            const data = JSON.parse(datain)[0]
+            const data = datain[0]
             
             const unorderedMonths = data.map(row => row.date);
             // Create an array of indices from the unorderedMonths
@@ -174,7 +174,7 @@ async function displayData(token) {
                 }
               );
               
-              const total = JSON.parse(datain)[1];
+              const total = datain[1];
                 new Chart(
                     document.getElementById('total-pay'),
                     {
@@ -198,7 +198,7 @@ async function displayData(token) {
             }
         } catch {
             document.getElementById('message-display').innerText = "Logged in as " + user
-            document.getElementById('data-display').innerText = datain;
+            document.getElementById('data-display').innerText = typeof datain === 'string' ? datain : JSON.stringify(datain);
         }
 
     } catch (error) {